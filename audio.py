@@ -0,0 +1,158 @@
+# XO-CHIP audio
+#
+# While the sound timer runs, the machine plays its 16 byte audio pattern
+# (F002) as 128 one-bit samples, looped, at 4000 * 2 ** ((pitch - 64) / 48)
+# bits per second (Fx3A). CHIP-8 and SCHIP play the default pattern at the
+# default pitch, which Octo makes a 440 Hz square-ish tone.
+#
+# Each (pattern, pitch) is synthesized once into a buffer that loops
+# seamlessly, and kept. Every frame the stream copies out as many samples
+# as the timer ticks that passed stood for, carrying on from where the last
+# frame left off, so the wave stays in phase across frames and across
+# pattern and pitch changes. They go into a ring buffer that is handed to
+# the mixer a frame or two at a time through a channel's queue. pygame has
+# no callback to pull from, but queueing never waits, and if the mixer
+# falls behind the oldest samples are dropped instead.
+
+import array, math
+
+RATE = 44100 # Samples per second asked of the mixer
+TIMER_HZ = 60 # Sound timer ticks per second
+AMPLITUDE = 4096
+MIN_LENGTH = 2048 # Samples in a synthesized loop, at least
+MAX_WAVES = 256
+PRIME = 3 # Frames buffered before playback starts
+CAPACITY = 8 # Frames the ring buffer holds before it drops samples
+
+def playback_rate(pitch):
+    # Pattern bits per second
+    return 4000 * 2 ** ((pitch - 64) / 48)
+
+_waves = {}
+
+def waveform(pattern, pitch, rate=RATE, channels=1):
+    # Signed 16-bit samples of the pattern, looped a whole number of times,
+    # so the buffer itself can be looped without a click. Rounding the loop
+    # to whole samples is at most half a sample out over 2048 or more.
+    key = (bytes(pattern), pitch, rate, channels)
+    if key not in _waves:
+        step = playback_rate(pitch) / rate # Bits per sample
+        loops = math.ceil(MIN_LENGTH * step / 128)
+        length = round(128 * loops / step)
+        bits = [pattern[bit >> 3] >> (7 - (bit & 7)) & 1 for bit in range(128)]
+        levels = [AMPLITUDE if bit else -AMPLITUDE for bit in bits]
+        samples = array.array("h", (levels[i * 128 * loops // length % 128]
+                                    for i in range(length)
+                                    for _ in range(channels)))
+        if len(_waves) >= MAX_WAVES:
+            _waves.clear()
+        _waves[key] = samples.tobytes()
+    return _waves[key]
+
+class AudioStream:
+    # Call update() once a frame, before the timers tick. The mixer is only
+    # started the first time the machine makes a sound, and if there is no
+    # audio device it stays quiet.
+    def __init__(self):
+        self.channel = None # False once the mixer has failed to start
+        self.rate = RATE
+        self.channels = 1
+        self.key = None # (pattern, pitch) of the wave playing
+        self.wave = b""
+        self.position = 0 # Byte offset into the wave
+        self.carry = 0.0 # Fraction of a sample owed from the last frame
+        self.ring = bytearray()
+        self.read = 0
+        self.level = 0 # Bytes in the ring buffer
+
+    def start(self):
+        import pygame
+        try:
+            pygame.mixer.init(RATE, -16, 1, 512)
+            self.rate, size, self.channels = pygame.mixer.get_init()
+            if size != -16:
+                raise pygame.error(f"Unsupported sample format {size}")
+            self.channel = pygame.mixer.Channel(0)
+        except pygame.error:
+            self.channel = False
+            return
+        self.sound = pygame.mixer.Sound
+        self.frame_bytes = 2 * self.channels
+        self.ring = bytearray(self.samples(CAPACITY) * self.frame_bytes)
+
+    def samples(self, ticks):
+        return round(ticks * self.rate / TIMER_HZ)
+
+    def update(self, chip, ticks):
+        # Synthesize the sound of the next ticks timer ticks
+        on = min(chip.sound_timer, ticks)
+        if on and self.channel is None:
+            self.start()
+        if not self.channel:
+            return
+        if on:
+            self.select(chip.audio, chip.pitch)
+            exact = on * self.rate / TIMER_HZ + self.carry
+            count = int(exact)
+            self.carry = exact - count
+            self.generate(count * self.frame_bytes)
+        self.feed(on)
+
+    def select(self, pattern, pitch):
+        key = (pattern, pitch)
+        if key == self.key:
+            return
+        wave = waveform(pattern, pitch, self.rate, self.channels)
+        if self.wave:
+            # The same fraction of the way through the new wave
+            frames = self.position // self.frame_bytes * (len(wave) // self.frame_bytes)
+            self.position = frames // (len(self.wave) // self.frame_bytes) * self.frame_bytes
+        self.key = key
+        self.wave = wave
+
+    def generate(self, size):
+        # Copy size bytes of the looped wave into the ring buffer
+        wave = self.wave
+        while size:
+            chunk = wave[self.position:self.position + size]
+            self.push(chunk)
+            size -= len(chunk)
+            self.position = (self.position + len(chunk)) % len(wave)
+
+    def push(self, data):
+        ring = self.ring
+        if len(data) > len(ring):
+            data = data[len(data) - len(ring):]
+        overflow = self.level + len(data) - len(ring)
+        if overflow > 0:
+            # Drop the oldest samples
+            self.read = (self.read + overflow) % len(ring)
+            self.level -= overflow
+        write = (self.read + self.level) % len(ring)
+        first = min(len(data), len(ring) - write)
+        ring[write:write + first] = data[:first]
+        ring[:len(data) - first] = data[first:]
+        self.level += len(data)
+
+    def pull(self):
+        # Everything in the ring buffer, emptying it
+        ring = self.ring
+        end = self.read + self.level
+        data = bytes(ring[self.read:end]) + bytes(ring[:max(0, end - len(ring))])
+        self.read = end % len(ring)
+        self.level = 0
+        return data
+
+    def feed(self, sounding):
+        # Hand the buffered samples to the mixer if it is ready for more.
+        # Playback only starts with PRIME frames buffered, so the next
+        # frame's samples arrive before these run out, unless the sound is
+        # ending anyway.
+        if not self.level:
+            return
+        if not self.channel.get_busy():
+            if sounding and self.level < self.samples(PRIME) * self.frame_bytes:
+                return
+            self.channel.play(self.sound(buffer=self.pull()))
+        elif self.channel.get_queue() is None:
+            self.channel.queue(self.sound(buffer=self.pull()))
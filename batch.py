@@ -0,0 +1,459 @@
+# Lockstep batch emulation with NumPy
+#
+# Runs many copies of one ROM side by side, each with its own keys and RNG
+# seed. All machine state has a leading instance axis. Every step, the
+# instances are grouped by the kind of instruction they are on, and each
+# group is executed with array operations. A CHIP8 or SCHIP batch gives
+# the same per-instance results as the scalar core, with instance i
+# matching a core made with seed=seeds[i].
+#
+# Every step costs a fixed few dozen microseconds of NumPy calls however
+# few instances there are, so a batch only beats one scalar core at about
+# 100 instances that stay on the same instructions, and reaches three times
+# its speed in total from about 1000. Instances that go separate ways are
+# split into groups, each paying that cost again. Cxnn draws from each
+# instance's own random.Random in Python, and scalar cores skip idle loops
+# while a batch runs them, so ROMs that spend their time waiting are
+# better off in fleet.py.
+
+import random
+
+import numpy as np
+
+from core import specialize
+from fontset import fontset
+
+class Batch:
+    def __init__(self, core, cartdata, count, seeds=None):
+        self.quirks = dict(core.profile)
+        if self.quirks["planes"] or self.quirks["long_skip"]:
+            raise ValueError("Batches only support the CHIP8 and SCHIP cores")
+        self.type = self.quirks["type"]
+        self.error = core.error
+        self.count = count
+        size = self.quirks["memory"]
+        width, height = self.quirks["screen"]
+
+        self.memory = np.zeros((count, size), np.uint8)
+        self.memory[:, 80:80 + len(fontset)] = np.frombuffer(bytes(fontset), np.uint8)
+        self.memory[:, 512:512 + len(cartdata)] = np.frombuffer(cartdata, np.uint8)
+        self.V = np.zeros((count, 16), np.uint8)
+        self.I = np.zeros(count, np.int64)
+        self.pc = np.full(count, 512, np.int64)
+        self.gfx = np.zeros((count, width*height), np.uint8)
+        self.delay_timer = np.zeros(count, np.int64)
+        self.sound_timer = np.zeros(count, np.int64)
+        self.keys = np.zeros((count, 16), np.uint8)
+        self.drawFlag = np.zeros(count, bool)
+        self.stack = np.zeros((count, 16), np.int64)
+        self.sp = np.zeros(count, np.int64)
+        self.keypress_tmp = np.zeros((count, 16), bool)
+        self.hires = np.zeros(count, bool)
+        self.flags = np.zeros((count, 8), np.uint8)
+
+        # Instances stop when they hit an error or exit
+        self.running = np.ones(count, bool)
+        self.exited = np.zeros(count, bool)
+        self.errors = [None] * count
+        # Frames each instance has run to the end
+        self.frames = np.zeros(count, np.int64)
+        seeds = range(count) if seeds is None else seeds
+        self.rngs = [random.Random(seed) for seed in seeds]
+
+        # Opcode -> index of the batch handler for it
+        table = specialize(self.quirks, False, 1)
+        names = sorted({handler.__name__ for handler, _ in table})
+        self.handlers = [getattr(self, name) for name in names]
+        self.classes = np.array(
+            [names.index(handler.__name__) for handler, _ in table], np.int64
+        )
+
+    def fail(self, sel, message):
+        # Stop the instances in sel with an error
+        for i in sel:
+            self.errors[i] = message(i) if callable(message) else message
+        self.running[sel] = False
+
+    def step(self):
+        # Run one instruction on every running instance
+        sel = np.nonzero(self.running)[0]
+        size = self.memory.shape[1]
+        bad = self.pc[sel] + 1 >= size
+        if bad.any():
+            self.fail(sel[bad], "bytearray index out of range")
+            sel = sel[~bad]
+        pc = self.pc[sel]
+        opcode = (self.memory[sel, pc].astype(np.int64) << 8) | self.memory[sel, pc + 1]
+        classes = self.classes[opcode]
+        first = classes[0] if len(classes) else 0
+        if (classes == first).all():
+            # Usually every instance is on the same kind of instruction
+            if len(classes):
+                self.handlers[first](sel, opcode)
+        else:
+            # Otherwise group them, in one sort instead of a pass per group
+            order = np.argsort(classes, kind="stable")
+            ordered = classes[order]
+            for group in np.split(order, np.flatnonzero(ordered[1:] != ordered[:-1]) + 1):
+                self.handlers[classes[group[0]]](sel[group], opcode[group])
+        # Instances that failed or exited keep the pc of that instruction
+        self.pc[sel[self.running[sel]]] += 2
+
+    def run_frames(self, frames, tpf):
+        for _ in range(frames):
+            for _ in range(tpf):
+                if not self.running.any():
+                    return
+                self.step()
+            self.delay_timer[self.running] = np.maximum(0, self.delay_timer[self.running] - 1)
+            self.sound_timer[self.running] = np.maximum(0, self.sound_timer[self.running] - 1)
+            self.frames[self.running] += 1
+
+    def state(self, i):
+        # The same fields as Core.state() for instance i. A batch runs idle
+        # loops instead of skipping them, so it never skips instructions.
+        return {
+            "type": self.type,
+            "frames": int(self.frames[i]),
+            "exited": bool(self.exited[i]),
+            "hires": bool(self.hires[i]),
+            "gfx": self.gfx[i].tobytes(),
+            "gfx2": None,
+            "V": self.V[i].tobytes(),
+            "I": int(self.I[i]),
+            "pc": int(self.pc[i]),
+            "stack": [int(a) for a in self.stack[i, :self.sp[i]]],
+            "delay_timer": int(self.delay_timer[i]),
+            "sound_timer": int(self.sound_timer[i]),
+            "skipped": 0,
+        }
+
+    def outside(self, sel, last):
+        # Fail the instances whose access up to address last runs out of
+        # memory, and return which ones they were
+        bad = last >= self.memory.shape[1]
+        if bad.any():
+            self.fail(sel[bad], "bytearray index out of range")
+        return bad
+
+    def skip(self, sel, condition):
+        self.pc[sel[condition]] += 2
+
+    # Handlers, each given the instances in the group and their opcodes
+
+    def op_unknown(self, sel, op):
+        self.fail(sel, lambda i: "Unknown OpCode at {}: 0x{:04X}".format(
+            hex(self.pc[i]), int(self.memory[i, self.pc[i]]) << 8 | int(self.memory[i, self.pc[i] + 1])
+        ))
+
+    def op_00E0(self, sel, op):
+        # 00E0: Clear screen
+        self.gfx[sel] = 0
+        self.drawFlag[sel] = True
+
+    def op_00EE(self, sel, op):
+        # 00EE: Return from subroutine
+        empty = self.sp[sel] == 0
+        self.fail(sel[empty], lambda i: f"Return at {hex(self.pc[i])} has nowhere to go")
+        sel = sel[~empty]
+        self.sp[sel] -= 1
+        self.pc[sel] = self.stack[sel, self.sp[sel]] - 2
+
+    def op_1nnn(self, sel, op):
+        # 1nnn: Jump to [nnn]
+        self.pc[sel] = (op & 0xFFF) - 2
+
+    def op_2nnn(self, sel, op):
+        # 2nnn: Call subroutine at [nnn]
+        full = self.sp[sel] == 16
+        self.fail(sel[full], "Stack is full, cannot call subroutine")
+        sel, op = sel[~full], op[~full]
+        self.stack[sel, self.sp[sel]] = self.pc[sel] + 2
+        self.sp[sel] += 1
+        self.pc[sel] = (op & 0xFFF) - 2
+
+    def op_3xnn(self, sel, op):
+        # 3xnn: Skips next instruction if V[x] equals [nn]
+        self.skip(sel, self.V[sel, op >> 8 & 15] == op & 0xFF)
+
+    def op_4xnn(self, sel, op):
+        # 4xnn: Skips next instruction if V[x] doesn't equal [nn]
+        self.skip(sel, self.V[sel, op >> 8 & 15] != op & 0xFF)
+
+    def op_5xy0(self, sel, op):
+        # 5xy0: Skips next instruction if V[x] equals V[y]
+        self.skip(sel, self.V[sel, op >> 8 & 15] == self.V[sel, op >> 4 & 15])
+
+    def op_6xnn(self, sel, op):
+        # 6xnn: Set V[x] to [nn]
+        self.V[sel, op >> 8 & 15] = op & 0xFF
+
+    def op_7xnn(self, sel, op):
+        # 7xnn: Add [nn] to V[x]
+        x = op >> 8 & 15
+        self.V[sel, x] = (self.V[sel, x].astype(np.int64) + (op & 0xFF)) % 256
+
+    def op_8xy0(self, sel, op):
+        # 8xy0: Set V[x] to V[y]
+        self.V[sel, op >> 8 & 15] = self.V[sel, op >> 4 & 15]
+
+    def op_8xy1(self, sel, op):
+        # 8xy1: Set V[x] to V[x] OR V[y]
+        x = op >> 8 & 15
+        self.V[sel, x] |= self.V[sel, op >> 4 & 15]
+
+    def op_8xy2(self, sel, op):
+        # 8xy2: Set V[x] to V[x] AND V[y]
+        x = op >> 8 & 15
+        self.V[sel, x] &= self.V[sel, op >> 4 & 15]
+
+    def op_8xy3(self, sel, op):
+        # 8xy3: Set V[x] to V[x] XOR V[y]
+        x = op >> 8 & 15
+        self.V[sel, x] ^= self.V[sel, op >> 4 & 15]
+
+    def op_8xy4(self, sel, op):
+        # 8xy4: Add V[y] to V[x], and set Vf to whether there was an overflow
+        x, y = op >> 8 & 15, op >> 4 & 15
+        total = self.V[sel, x].astype(np.int64) + self.V[sel, y]
+        self.V[sel, x] = total % 256
+        self.V[sel, 15] = total > 256
+
+    def op_8xy5(self, sel, op):
+        # 8xy5: Subtract V[y] from V[x], and set Vf to whether there was no borrow
+        x, y = op >> 8 & 15, op >> 4 & 15
+        total = self.V[sel, x].astype(np.int64) - self.V[sel, y]
+        self.V[sel, x] = total % 256
+        self.V[sel, 15] = total >= 0
+
+    def op_8xy6(self, sel, op):
+        # 8xy6: Shift V[y] right into V[x], with the bit shifted out in Vf
+        x, y = op >> 8 & 15, op >> 4 & 15
+        self.V[sel, 15] = self.V[sel, y] & 1
+        self.V[sel, x] = self.V[sel, y] >> 1
+
+    def op_8xy7(self, sel, op):
+        # 8xy7: Set V[x] to V[y] minus V[x], and Vf to whether there was no borrow
+        x, y = op >> 8 & 15, op >> 4 & 15
+        total = self.V[sel, y].astype(np.int64) - self.V[sel, x]
+        self.V[sel, x] = total % 256
+        self.V[sel, 15] = total >= 0
+
+    def op_8xyE(self, sel, op):
+        # 8xyE: Shift V[y] left into V[x], with the bit shifted out in Vf
+        x, y = op >> 8 & 15, op >> 4 & 15
+        self.V[sel, 15] = self.V[sel, y] >> 7
+        self.V[sel, x] = self.V[sel, y] << 1
+
+    def op_9xy0(self, sel, op):
+        # 9xy0: Skips next instruction if V[x] doesn't equal V[y]
+        self.skip(sel, self.V[sel, op >> 8 & 15] != self.V[sel, op >> 4 & 15])
+
+    def op_Annn(self, sel, op):
+        # Annn: Set I to [nnn]
+        self.I[sel] = op & 0xFFF
+
+    def op_Bnnn(self, sel, op):
+        # Bnnn: Jump to [nnn] plus V0
+        self.pc[sel] = (op & 0xFFF) + self.V[sel, 0].astype(np.int64) - 2
+
+    def op_Cxnn(self, sel, op):
+        # Cxnn: Set V[x] to a random number, and bitwise-AND it with [nn]
+        values = [self.rngs[i].randint(0, 255) for i in sel]
+        self.V[sel, op >> 8 & 15] = np.array(values, np.int64) & op & 0xFF
+
+    def op_Dxyn(self, sel, op):
+        # Dxyn: XOR sprite stored at the I pointer with height [n] at [x], [y] onto display
+        size = self.memory.shape[1]
+        n = op & 15
+        big = n == 0
+        if "schip" not in self.quirks["instructions"]:
+            big[:] = False
+        # 16x16 sprites fail if they run out of memory, like the scalar
+        # core, while 8 wide sprites are cut short
+        bad = self.outside(sel, np.where(big, self.I[sel] + 31, 0))
+        sel, op, n, big = sel[~bad], op[~bad], n[~bad], big[~bad]
+        x = self.V[sel, op >> 8 & 15].astype(np.int64)
+        y = self.V[sel, op >> 4 & 15].astype(np.int64)
+        I = self.I[sel][:, None]
+        # Only as many rows and columns as the tallest and widest sprite
+        wide = big.any()
+        rows = np.arange(16 if wide else int(n.max(initial=0)))
+        columns = np.arange(16 if wide else 8)
+        # Sprite rows as 16 bit values, with 8 wide rows in the high byte
+        addresses = np.where(big[:, None], I + rows*2, I + rows)
+        used = big[:, None] | (rows < n[:, None]) & (addresses < size)
+        addresses = np.minimum(addresses, size - 2)
+        high = self.memory[sel[:, None], addresses].astype(np.int64)
+        if wide:
+            low = self.memory[sel[:, None], addresses + 1].astype(np.int64)
+            sprite = np.where(used, high << 8 | np.where(big[:, None], low, 0), 0)
+        else:
+            sprite = np.where(used, high << 8, 0)
+        bits = sprite[:, :, None] >> (15 - columns) & 1
+        # Where each set bit lands on screen
+        group, sy, sx = np.nonzero(bits)
+        width = np.where(self.hires[sel], 128, 64)[group]
+        height = np.where(self.hires[sel], 64, 32)[group]
+        pixels = (y[group] + sy) % height * width + (x[group] + sx) % width
+        # Flat indexes into every instance's screen at once
+        gfx = self.gfx.reshape(-1)
+        pixels += sel[group] * self.gfx.shape[1]
+        hit = gfx[pixels] == 1
+        gfx[pixels] ^= 1
+        self.V[sel, 15] = np.bincount(group[hit], minlength=len(sel)) > 0
+        self.drawFlag[sel] = True
+
+    def op_Ex9E(self, sel, op):
+        # Ex9E: Skips next instruction if the key V[x] is pressed
+        key = self.V[sel, op >> 8 & 15]
+        self.skip(sel, (key < 16) & (self.keys[sel, key & 15] != 0))
+
+    def op_ExA1(self, sel, op):
+        # ExA1: Skips next instruction if the key V[x] is not pressed
+        key = self.V[sel, op >> 8 & 15]
+        self.skip(sel, (key > 15) | (self.keys[sel, key & 15] == 0))
+
+    def op_Fx07(self, sel, op):
+        # Fx07: Set V[x] to delay timer
+        self.V[sel, op >> 8 & 15] = self.delay_timer[sel]
+
+    def op_Fx15(self, sel, op):
+        # Fx15: Set delay timer to V[x]
+        self.delay_timer[sel] = self.V[sel, op >> 8 & 15]
+
+    def op_Fx18(self, sel, op):
+        # Fx18: Set sound timer to V[x]
+        self.sound_timer[sel] = self.V[sel, op >> 8 & 15]
+
+    def op_Fx0A(self, sel, op):
+        # Fx0A: Await key press and release and store in V[x]
+        keys = self.keys[sel] != 0
+        self.keypress_tmp[sel] |= keys
+        released = self.keypress_tmp[sel] & ~keys
+        success = released.any(1)
+        # The highest released key wins, like the scalar core
+        highest = 15 - np.argmax(released[:, ::-1], axis=1)
+        self.V[sel[success], op[success] >> 8 & 15] = highest[success]
+        self.keypress_tmp[sel] &= ~released
+        self.pc[sel[~success]] -= 2
+
+    def op_Fx1E(self, sel, op):
+        # Fx1E: Add V[x] to I, and set Vf to whether there was an overflow or not
+        total = self.I[sel] + self.V[sel, op >> 8 & 15].astype(np.int64)
+        self.I[sel] = total % 0x1000
+        self.V[sel, 15] = total > 0xFFF
+
+    def op_Fx29(self, sel, op):
+        # Fx29: Set I to the fontset index of the value of V[x]
+        digit = self.V[sel, op >> 8 & 15].astype(np.int64) % 16
+        self.I[sel] = 0x50 + (len(fontset) // 48) * digit
+
+    def op_Fx30(self, sel, op):
+        # Fx30: Set I to the large fontset index of the value of V[x]
+        digit = self.V[sel, op >> 8 & 15].astype(np.int64) % 16
+        self.I[sel] = 0x50 + (len(fontset) // 48) * (16 + digit * 2)
+
+    def op_Fx33(self, sel, op):
+        # Fx33: Dump the 3-digit decimal representation of V[x] into
+        # memory, starting at I
+        bad = self.outside(sel, self.I[sel] + 2)
+        sel, op = sel[~bad], op[~bad]
+        value = self.V[sel, op >> 8 & 15]
+        for i, digit in enumerate((value // 100, value // 10 % 10, value % 10)):
+            self.memory[sel, self.I[sel] + i] = digit
+
+    def registers(self, sel, op):
+        # Instances and register counts for Fx55/Fx65, failing any that
+        # would go out of memory
+        count = (op >> 8 & 15) + 1
+        bad = self.outside(sel, self.I[sel] + count - 1)
+        return sel[~bad], count[~bad]
+
+    def op_Fx55(self, sel, op):
+        # Fx55: Dump V0..V[x] into memory, starting at I
+        sel, count = self.registers(sel, op)
+        for i in range(16):
+            part = sel[count > i]
+            self.memory[part, self.I[part] + i] = self.V[part, i]
+        if self.quirks["load_store_increment"]:
+            self.I[sel] += count
+
+    def op_Fx65(self, sel, op):
+        # Fx65: Load memory into V0..V[x], starting at I
+        sel, count = self.registers(sel, op)
+        for i in range(16):
+            part = sel[count > i]
+            self.V[part, i] = self.memory[part, self.I[part] + i]
+        if self.quirks["load_store_increment"]:
+            self.I[sel] += count
+
+    # SCHIP
+
+    def op_00Cn(self, sel, op):
+        # 00Cn: Scroll the display down n pixels
+        for n in np.unique(op & 15):
+            part = sel[(op & 15) == n]
+            if n:
+                amount = n * 128
+                self.gfx[part, amount:] = self.gfx[part, :-amount]
+                self.gfx[part, :amount] = 0
+        self.drawFlag[sel] = True
+
+    def op_00FB(self, sel, op):
+        # 00FB: Scroll the display right 4 pixels
+        rows = self.gfx[sel].reshape(len(sel), 64, 128)
+        rows[:, :, 4:] = rows[:, :, :124].copy()
+        rows[:, :, :4] = 0
+        self.gfx[sel] = rows.reshape(len(sel), -1)
+        self.drawFlag[sel] = True
+
+    def op_00FC(self, sel, op):
+        # 00FC: Scroll the display left 4 pixels
+        rows = self.gfx[sel].reshape(len(sel), 64, 128)
+        rows[:, :, :124] = rows[:, :, 4:].copy()
+        rows[:, :, 124:] = 0
+        self.gfx[sel] = rows.reshape(len(sel), -1)
+        self.drawFlag[sel] = True
+
+    def op_00FD(self, sel, op):
+        # 00FD: Exit
+        self.exited[sel] = True
+        self.running[sel] = False
+
+    def resolution(self, sel, hires):
+        self.hires[sel] = hires
+        self.gfx[sel] = 0
+        self.drawFlag[sel] = True
+
+    def op_00FE(self, sel, op):
+        # 00FE: Set low resolution and clear the screen
+        self.resolution(sel, False)
+
+    def op_00FF(self, sel, op):
+        # 00FF: Set high resolution and clear the screen
+        self.resolution(sel, True)
+
+    def flag_registers(self, sel, op):
+        x = op >> 8 & 15
+        bad = x >= 8
+        self.fail(sel[bad], lambda i: "Flag index to high: {}".format(
+            self.memory[i, self.pc[i]] & 15
+        ))
+        return sel[~bad], x[~bad] + 1
+
+    def op_Fx75(self, sel, op):
+        # Fx75: Dump V0..V[x] into flag memory
+        sel, count = self.flag_registers(sel, op)
+        for i in range(8):
+            part = sel[count > i]
+            self.flags[part, i] = self.V[part, i]
+        self.I[sel] += count
+
+    def op_Fx85(self, sel, op):
+        # Fx85: Load flag memory into V0..V[x]
+        sel, count = self.flag_registers(sel, op)
+        for i in range(8):
+            part = sel[count > i]
+            self.V[part, i] = self.flags[part, i]
+        self.I[sel] += count
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+# ROM benchmarks
+#
+# Runs every ROM in examples/, and the Octo sources in tests/ compiled with
+# octo.py, headlessly on each core for a fixed number of frames with a
+# fixed seed. Each run reports instructions executed per second,
+# instructions skipped by idle detection, frames per second, wall time and
+# peak memory, and is appended to a JSON history file. Pairs that run
+# slower than a stored baseline by more than the threshold are flagged, and
+# make the exit status 1.
+#
+# Memory is measured in a second, traced run, as tracemalloc slows down
+# everything it traces.
+#
+# Startup is timed too, as the fastest of a few fresh interpreters running
+# main.py for no frames and importing the window, and is flagged when it
+# gets slower than the baseline the same way.
+
+import argparse, glob, json, os, platform, subprocess, sys, time, tracemalloc
+
+from cores import CORES, TPF
+from blocks import BlockEngine
+from compiler import CompileError, compile_octo
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# History and baseline files, kept out of git
+RESULTS = os.path.join(HERE, "bench")
+
+# Commands whose time to run is startup time, as arguments to python
+STARTUP = {
+    "headless": [os.path.join(HERE, "main.py"), os.path.join(HERE, "examples", "test.ch8"),
+                 "--headless", "--frames", "0"],
+    "window": ["-c", "import window"],
+}
+
+def default_roms():
+    return (sorted(glob.glob(os.path.join(HERE, "examples", "*.ch8"))) +
+            sorted(glob.glob(os.path.join(HERE, "tests", "*.8o"))))
+
+def load_rom(path):
+    if path.endswith(".8o"):
+        return compile_octo(path)[0]
+    with open(path, "rb") as f:
+        return f.read()
+
+def run_once(variant, cartdata, frames, tpf, seed, blocks):
+    chip = CORES[variant](cartdata, seed=seed)
+    runner = BlockEngine(chip) if blocks else chip
+    start = time.perf_counter()
+    state = runner.run_frames(frames, tpf)
+    return state, time.perf_counter() - start
+
+def bench(rom, variant, cartdata, frames, tpf, seed, blocks, repeat=1):
+    # The fastest of repeat runs, which is the one least disturbed by the host
+    result = {"rom": rom, "core": variant, "error": None}
+    try:
+        runs = [run_once(variant, cartdata, frames, tpf, seed, blocks)
+                for _ in range(repeat)]
+        state, wall = min(runs, key=lambda run: run[1])
+        tracemalloc.start()
+        try:
+            run_once(variant, cartdata, frames, tpf, seed, blocks)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+        return result
+    # A frame that ends on 00FD still ran, if only partly. Skipped
+    # instructions take no time, so they don't count towards IPS.
+    ran = state["frames"] + state["exited"]
+    executed = max(0, ran * tpf - state["skipped"])
+    result.update({
+        "frames": state["frames"],
+        "exited": state["exited"],
+        "wall": wall,
+        "ips": executed / wall if wall else 0.0,
+        "executed": executed,
+        "fps": ran / wall if wall else 0.0,
+        "skipped": state["skipped"],
+        "peak_memory": peak,
+    })
+    return result
+
+def startup(repeat):
+    # {name: seconds}, or None for a command that failed
+    times = {}
+    for name, args in STARTUP.items():
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = subprocess.run([sys.executable] + args, cwd=HERE,
+                                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            elapsed = time.perf_counter() - start
+            if result.returncode:
+                best = None
+                break
+            best = elapsed if best is None else min(best, elapsed)
+        times[name] = best
+    return times
+
+def key(result):
+    return f"{result['rom']}:{result['core']}"
+
+def regressions(results, times, baseline, threshold):
+    # Messages for every pair more than threshold slower than the baseline,
+    # and every startup that takes more than threshold longer
+    slow = []
+    for result in results:
+        base = baseline.get(key(result))
+        if result["error"] is None and base and result["ips"] < base * (1 - threshold):
+            slow.append(f"{key(result)} runs at {result['ips']:.0f} IPS, "
+                        f"{1 - result['ips'] / base:.0%} slower than the baseline {base:.0f}")
+    for name, seconds in times.items():
+        base = baseline.get(f"startup:{name}")
+        if seconds is not None and base and seconds > base * (1 + threshold):
+            slow.append(f"startup:{name} takes {seconds * 1000:.0f} ms, "
+                        f"{seconds / base - 1:.0%} longer than the baseline {base * 1000:.0f} ms")
+    return slow
+
+def load_json(path, default):
+    if not os.path.isfile(path):
+        return default
+    with open(path) as f:
+        return json.load(f)
+
+def save_json(path, data):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(data, f, indent=1)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("roms", nargs="*",
+                        help="ROMs or Octo sources to run (default: examples/*.ch8 "
+                             "and tests/*.8o)")
+    parser.add_argument("--cores", nargs="+", choices=CORES, default=list(CORES),
+                        help="Interpreters to run each ROM on")
+    parser.add_argument("--frames", type=int, default=600,
+                        help="Frames to run per ROM")
+    parser.add_argument("--cycles-per-frame", type=int, default=TPF,
+                        help="Instructions to run per frame")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="Seed for the random numbers of Cxnn")
+    parser.add_argument("--blocks", action="store_true",
+                        help="Run through the basic block translation cache")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Runs per ROM and core, of which the fastest counts")
+    parser.add_argument("--history", default=os.path.join(RESULTS, "history.json"),
+                        help="JSON file to append the results to")
+    parser.add_argument("--baseline", default=os.path.join(RESULTS, "baseline.json"),
+                        help="JSON file of instructions per second to compare against")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="Store these results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="Fraction slower than the baseline that counts "
+                             "as a regression")
+    args = parser.parse_args()
+
+    results = []
+    for path in args.roms or default_roms():
+        rom = os.path.relpath(path, HERE)
+        try:
+            cartdata = load_rom(path)
+        except (OSError, CompileError) as e:
+            print(f"{rom}: {e}", file=sys.stderr)
+            continue
+        for variant in args.cores:
+            result = bench(rom, variant, cartdata, args.frames,
+                           args.cycles_per_frame, args.seed, args.blocks, args.repeat)
+            results.append(result)
+            if result["error"]:
+                print(f"{rom:32} {variant:7} error: {result['error']}")
+            else:
+                print(f"{rom:32} {variant:7} {result['ips']:12.0f} IPS "
+                      f"{result['skipped']:10} skipped "
+                      f"{result['fps']:9.1f} FPS {result['wall']:8.3f} s "
+                      f"{result['peak_memory'] / 1024:9.1f} KiB")
+
+    times = startup(args.repeat)
+    for name, seconds in times.items():
+        print(f"startup:{name:24} " + (f"{seconds * 1000:8.1f} ms" if seconds is not None else "failed"))
+
+    history = load_json(args.history, [])
+    history.append({
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "frames": args.frames,
+        "cycles_per_frame": args.cycles_per_frame,
+        "seed": args.seed,
+        "blocks": args.blocks,
+        "repeat": args.repeat,
+        "results": results,
+        "startup": times,
+    })
+    save_json(args.history, history)
+
+    slow = regressions(results, times, load_json(args.baseline, {}), args.threshold)
+    for message in slow:
+        print("Regression: " + message)
+    if args.save_baseline:
+        baseline = {key(result): result["ips"] for result in results if result["error"] is None}
+        baseline.update({f"startup:{name}": seconds
+                         for name, seconds in times.items() if seconds is not None})
+        save_json(args.baseline, baseline)
+    return 1 if slow else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,278 @@
+# Basic block translation
+#
+# Instead of decoding and running one instruction per cycle() call, the
+# block engine finds the straight-line run of instructions starting at pc,
+# compiles it into a single Python function and caches that by its start
+# address. Simple register instructions are inlined into the generated
+# code, everything else calls the core's own handler, so the engine
+# behaves exactly like the core it wraps. A block never runs past the end
+# of the frame: when fewer instructions are left than a block holds, a copy
+# cut short at that many is compiled and cached by (start, limit), so the
+# timers tick and idle loops are skipped at the same instructions as on
+# the core. ROMs that wait for the next frame end it at the same place
+# every time, so those copies are reused.
+#
+# A write into a compiled block drops it, to be compiled again from the new
+# code. Some ROMs rewrite their own code all the time, though, and compiling
+# a block that is about to be dropped again costs far more than it saves, so
+# once a block has been rewritten REWRITES times the bytes written are left
+# to the interpreter. Blocks end before them, and a block starting on them
+# is a single instruction run through the core's handler.
+
+from decoder import parse_pattern
+
+MAX_BLOCK = 64 # Instructions per block
+REWRITES = 8 # Times a block can be rewritten before the bytes are interpreted
+
+# Inlined instructions, identical on every core
+INLINE = {
+    "6xnn": ["V[{x}] = {nn}"],
+    "7xnn": ["V[{x}] = (V[{x}] + {nn}) % 256"],
+    "8xy0": ["V[{x}] = V[{y}]"],
+    "8xy1": ["V[{x}] |= V[{y}]"],
+    "8xy2": ["V[{x}] &= V[{y}]"],
+    "8xy3": ["V[{x}] ^= V[{y}]"],
+    "8xy4": ["total = V[{x}] + V[{y}]",
+             "V[{x}] = total % 256",
+             "V[15] = total > 256"],
+    "8xy5": ["total = V[{x}] - V[{y}]",
+             "V[{x}] = total % 256",
+             "V[15] = total >= 0"],
+    "8xy6": ["V[15] = V[{y}] & 1",
+             "V[{x}] = (V[{y}]>>1)%256"],
+    "8xy7": ["total = V[{y}] - V[{x}]",
+             "V[{x}] = total % 256",
+             "V[15] = total >= 0"],
+    "8xyE": ["V[15] = V[{y}]//128",
+             "V[{x}] = (V[{y}]<<1)%256"],
+    "Annn": ["chip.I = {nnn}"],
+    "Cxnn": ["V[{x}] = randint(0, 255) & {nn}"],
+    "Fx07": ["V[{x}] = chip.delay_timer"],
+    "Fx15": ["chip.delay_timer = V[{x}]"],
+    "Fx18": ["chip.sound_timer = V[{x}]"],
+    "Fx1E": ["total = chip.I + V[{x}]",
+             "chip.I = total % 0x1000",
+             "V[15] = total > 0xFFF"],
+}
+
+# Instructions that may change pc, and so end a block
+BRANCHES = {
+    "00EE", "1nnn", "2nnn", "Bnnn", "3xnn", "4xnn", "5xy0", "9xy0",
+    "Ex9E", "ExA1", "Fx0A", "00FD", "unknown",
+}
+
+# Instructions that swap the core's decode table, and so end a block
+RETABLES = {"00FE", "00FF", "Fx01"}
+
+# Instructions whose handlers can report an idle loop, see Core.idle()
+SIGNALS = {"1nnn", "Fx0A"}
+
+# Instructions that write memory, as the range they write starting at I
+WRITES = {
+    "Fx33": "3",
+    "Fx55": "{x} + 1",
+    "5xy2": "max(0, {y} - {x} + 1)",
+}
+
+class BlockEngine:
+    def __init__(self, chip):
+        self.chip = chip
+        # Blocks are compiled against the decode table in use, so there is
+        # one cache for each table the core switches between
+        self.caches = {}
+        # address >> 4 -> (cache, key, start, end) of blocks in it, keyed by
+        # start, or (start, limit) if cut short
+        self.pages = {}
+        self.rewrites = {} # start -> times the block there was rewritten
+        self.hot = bytearray(len(chip.memory)) # Bytes left to the interpreter
+        self.lengths = {} # (name, args) -> bytes a WRITES instruction writes
+        self.budget = 0
+        self.signal = None # Idle signal from the last block run
+
+    def flush(self):
+        # Drop every compiled block, for when memory was changed externally
+        self.caches.clear()
+        self.pages.clear()
+
+    def prewarm(self, starts):
+        # Compile the blocks at these addresses now instead of when they are
+        # first reached, such as the block starts disasm found, against the
+        # decode table in use
+        blocks = self.caches.get(id(self.chip.table), {})
+        for start in starts:
+            if start not in blocks and start + 1 < len(self.chip.memory):
+                self.compile(start)
+
+    def invalidate(self, start, end):
+        # Drop every block covering memory[start:end]
+        if end <= start:
+            return
+        for page in range(start >> 4, ((end - 1) >> 4) + 1):
+            for block in [block for block in self.pages.get(page, ())
+                          if block[2] < end and start < block[3]]:
+                cache, key, address, stop = block
+                self.caches[cache].pop(key, None)
+                for other in range(address >> 4, ((stop - 1) >> 4) + 1):
+                    self.pages[other].discard(block)
+                if key != address:
+                    continue # Counted with the whole block
+                rewrites = self.rewrites.get(address, 0) + 1
+                self.rewrites[address] = rewrites
+                if rewrites >= REWRITES:
+                    low, high = max(start, address), min(end, stop)
+                    self.hot[low:high] = b"\1" * (high - low)
+
+    def interpret(self, chip, V):
+        # A block of the one instruction at pc, run by the core's handler,
+        # for bytes that keep being rewritten
+        memory = chip.memory
+        handler, args = chip.table[memory[chip.pc] << 8 | memory[chip.pc + 1]]
+        name = handler.__name__[3:]
+        start = chip.I
+        signal = handler(chip, *args)
+        if name in WRITES:
+            key = (name, args)
+            if key not in self.lengths:
+                fields = dict(zip([field for field, _, _ in parse_pattern(name)[2]], args))
+                self.lengths[key] = eval(WRITES[name].format(**fields))
+            self.invalidate(start, start + self.lengths[key])
+        if signal == "exit":
+            return -1
+        chip.pc += 2
+        return (1, signal) if signal else 1
+
+    def compile(self, start, limit=MAX_BLOCK):
+        chip = self.chip
+        memory = chip.memory
+        cache = id(chip.table)
+        key = start if limit == MAX_BLOCK else (start, limit)
+        namespace = {"randint": chip.rng.randint, "invalidate": self.invalidate}
+        lines = []
+        address = start
+        count = 0
+        ended = False
+        signals = False
+        while count < limit and not ended:
+            if count and address + 1 >= len(memory):
+                break
+            opcode = memory[address] << 8 | memory[address + 1]
+            handler, args = chip.table[opcode]
+            name = handler.__name__[3:]
+            fields = {}
+            if name != "unknown":
+                fields = dict(zip(
+                    [field for field, _, _ in parse_pattern(name)[2]], args
+                ))
+            if any(self.hot[address:address + (4 if name == "F000" else 2)]):
+                if count:
+                    break
+                # Left to the interpreter, which always reads memory afresh
+                self.caches.setdefault(cache, {})[key] = self.interpret
+                return self.interpret
+            count += 1
+            if name in INLINE:
+                lines += [line.format(**fields) for line in INLINE[name]]
+                address += 2
+            elif name == "F000" and address + 3 < len(memory):
+                # F000xxxx: Set I to xxxx
+                lines.append("chip.I = {:#x}".format(
+                    memory[address + 2] << 8 | memory[address + 3]
+                ))
+                address += 4
+            elif name == "00FD":
+                # 00FD: Exit, which the engine handles like cycle() does
+                lines.append(f"chip.pc = {address:#x}")
+                lines.append(f"return -{count}")
+                address += 2
+                ended = True
+            else:
+                # Anything else goes through the core's handler
+                call = f"h{count}"
+                namespace[call] = handler
+                lines.append(f"chip.pc = {address:#x}")
+                if name in WRITES:
+                    lines.append("start = chip.I")
+                call = f"{call}(chip{''.join(f', {arg}' for arg in args)})"
+                if name in SIGNALS:
+                    call = "signal = " + call
+                    signals = True
+                lines.append(call)
+                if name in WRITES:
+                    lines.append("invalidate(start, start + {})".format(
+                        WRITES[name].format(**fields)
+                    ))
+                address += 2
+                ended = name in BRANCHES or name in WRITES or name in RETABLES
+        if not ended:
+            lines.append(f"chip.pc = {address - 2:#x}")
+        lines.append("chip.pc += 2")
+        if signals:
+            lines.append(f"return ({count}, signal) if signal else {count}")
+        else:
+            lines.append(f"return {count}")
+        source = "def block(chip, V):\n    " + "\n    ".join(lines)
+        exec(compile(source, f"<block {hex(start)}>", "exec"), namespace)
+        block = namespace["block"]
+        block.length = count
+        self.caches.setdefault(cache, {})[key] = block
+        for page in range(start >> 4, ((address - 1) >> 4) + 1):
+            self.pages.setdefault(page, set()).add((cache, key, start, address))
+        return block
+
+    def step(self, noexit=False, budget=MAX_BLOCK):
+        # Run one block, cut short at budget instructions, and return how
+        # many instructions it ran
+        chip = self.chip
+        blocks = self.caches.get(id(chip.table))
+        block = blocks and blocks.get(chip.pc) or self.compile(chip.pc)
+        if budget < MAX_BLOCK and getattr(block, "length", 1) > budget:
+            # The end of the frame
+            block = self.caches[id(chip.table)].get((chip.pc, budget)) or \
+                    self.compile(chip.pc, budget)
+        count = block(chip, chip.V)
+        if count.__class__ is tuple:
+            count, self.signal = count
+        elif count < 0:
+            # 00FD: Exit
+            if not noexit:
+                return "exit"
+            chip.pc += 2
+            count = -count
+        return count
+
+    def run(self, count, noexit=False):
+        # Same as chip.run, a block at a time
+        chip = self.chip
+        chip.idle_watch = None
+        self.signal = None
+        self.budget += count
+        while self.budget > 0:
+            count = self.step(noexit, self.budget)
+            if count == "exit":
+                self.budget = 0 # The rest of the frame is dropped, as on the core
+                return "exit"
+            self.budget -= count
+            if self.signal:
+                self.budget -= chip.idle(self.signal, self.budget)
+                self.signal = None
+
+    def run_frames(self, frames, tpf, noexit=False):
+        # Same as chip.run_frames, a block at a time
+        chip = self.chip
+        for frame in range(frames):
+            if self.run(tpf, noexit) == "exit":
+                return chip.state(frame, exited=True)
+            chip.tick_timers()
+        return chip.state(frames)
+
+    def cycle(self, noexit=False):
+        # Drop-in replacement for chip.cycle, running the same number of
+        # instructions on average but a whole block at a time
+        chip = self.chip
+        self.budget += 1
+        if self.budget > 0:
+            count = self.step(noexit)
+            if count == "exit":
+                self.budget -= 1
+                return "exit"
+            self.budget -= count
@@ -0,0 +1,230 @@
+# Headless frame capture
+#
+# Records what a machine draws as an animated GIF, a sequence of PNGs or
+# raw RGB video, without pygame. Frames are rendered straight from the
+# framebuffer with the window's palette, only when the machine has drawn,
+# and at 128x64 times the scale whatever the resolution, so lores pixels
+# are doubled. A frame the same as the one before only makes that one
+# last longer. Each frame is written out as soon as the next different
+# one arrives, so only two frames are ever held, however long the
+# recording.
+#
+# GIF frames last whole hundredths of a second, so their delays are
+# rounded with the remainder carried, and each frame only covers the rows
+# that changed. PNGs are named by the frame they first appear on, which is
+# also how long each lasts. Raw video is RGB24 at a steady 60 frames per
+# second, for piping into an encoder, so frames are repeated for as long
+# as they last.
+
+import os, struct, sys, zlib
+
+from palette import PALETTE
+
+FPS = 60
+WIDTH, HEIGHT = 128, 64
+GIF_LOOP = 0 # Times an animated GIF repeats, 0 forever
+
+def render(chip, scale=1):
+    # Pixel values, one byte each, at 128x64 times scale
+    hires = chip.hires
+    width, height = (128, 64) if hires else (64, 32)
+    size = width*height
+    pixels = bytes(chip.gfx[:size])
+    if chip.quirks["planes"]:
+        pixels = (int.from_bytes(pixels, "big") |
+                  int.from_bytes(chip.gfx2[:size], "big") << 1).to_bytes(size, "big")
+    factor = scale if hires else 2*scale
+    if factor == 1:
+        return pixels
+    spread = [bytes([value]) * factor for value in range(4)]
+    rows = []
+    for y in range(height):
+        row = b"".join([spread[value] for value in pixels[y*width:(y+1)*width]])
+        rows.extend([row] * factor)
+    return b"".join(rows)
+
+class GifWriter:
+    def __init__(self, out, width, height):
+        self.out = out
+        self.width = width
+        self.height = height
+        self.last = None
+        self.carry = 0.0 # Hundredths of a second owed to the next frame
+        colors = b"".join(bytes(color) for color in PALETTE)
+        out.write(b"GIF89a" + struct.pack("<HHBBB", width, height, 0xF1, 0, 0) + colors)
+        # Netscape looping extension
+        out.write(b"\x21\xFF\x0BNETSCAPE2.0\x03\x01" + struct.pack("<H", GIF_LOOP) + b"\x00")
+
+    def frame(self, pixels, ticks):
+        # Browsers slow down delays under 2, so take the rest from later frames
+        exact = ticks * 100 / FPS + self.carry
+        delay = max(2, round(exact))
+        self.carry = exact - delay
+        top, bottom = 0, self.height
+        if self.last is not None:
+            width = self.width
+            changed = [y for y in range(self.height)
+                       if pixels[y*width:(y+1)*width] != self.last[y*width:(y+1)*width]]
+            if changed:
+                top, bottom = changed[0], changed[-1] + 1
+            else:
+                top, bottom = 0, 1
+        self.last = pixels
+        # Graphic control: keep what is under the next frame
+        self.out.write(b"\x21\xF9\x04\x04" + struct.pack("<H", delay) + b"\x00\x00")
+        self.out.write(b"\x2C" + struct.pack("<HHHHB", 0, top, self.width, bottom - top, 0))
+        data = lzw(pixels[top*self.width:bottom*self.width], 2)
+        self.out.write(b"\x02" + b"".join(
+            bytes([len(data[i:i+255])]) + data[i:i+255] for i in range(0, len(data), 255)) + b"\x00")
+
+    def close(self):
+        self.out.write(b"\x3B")
+        self.out.close()
+
+def lzw(pixels, min_size):
+    # GIF's variable width LZW, as bytes
+    clear = 1 << min_size
+    stop = clear + 1
+    out = bytearray()
+    buffer = 0
+    bits = 0
+
+    def emit(code):
+        nonlocal buffer, bits
+        buffer |= code << bits
+        bits += size
+        while bits >= 8:
+            out.append(buffer & 0xFF)
+            buffer >>= 8
+            bits -= 8
+
+    size = min_size + 1
+    emit(clear)
+    table = {}
+    next_code = stop + 1
+    prefix = None
+    for value in pixels:
+        if prefix is None:
+            prefix = value
+            continue
+        key = prefix << 8 | value
+        code = table.get(key)
+        if code is not None:
+            prefix = code
+            continue
+        emit(prefix)
+        if next_code == 4096:
+            emit(clear)
+            table = {}
+            next_code = stop + 1
+            size = min_size + 1
+        else:
+            table[key] = next_code
+            if next_code == 1 << size:
+                size += 1
+            next_code += 1
+        prefix = value
+    if prefix is not None:
+        emit(prefix)
+    emit(stop)
+    if bits:
+        out.append(buffer & 0xFF)
+    return bytes(out)
+
+def png(pixels, width, height):
+    # An indexed colour PNG
+    def chunk(kind, data):
+        return (struct.pack(">I", len(data)) + kind + data +
+                struct.pack(">I", zlib.crc32(kind + data)))
+    rows = b"".join(b"\x00" + pixels[y*width:(y+1)*width] for y in range(height))
+    return (b"\x89PNG\r\n\x1a\n" +
+            chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 3, 0, 0, 0)) +
+            chunk(b"PLTE", b"".join(bytes(color) for color in PALETTE)) +
+            chunk(b"IDAT", zlib.compress(rows, 9)) +
+            chunk(b"IEND", b""))
+
+class PngWriter:
+    def __init__(self, directory, width, height):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.width = width
+        self.height = height
+        self.start = 0 # Frame the next one first appears on
+
+    def frame(self, pixels, ticks):
+        path = os.path.join(self.directory, f"{self.start:06d}.png")
+        with open(path, "wb") as f:
+            f.write(png(pixels, self.width, self.height))
+        self.start += ticks
+
+    def close(self):
+        pass
+
+class RawWriter:
+    def __init__(self, out):
+        self.out = out
+        self.colors = [bytes(color) for color in PALETTE]
+
+    def frame(self, pixels, ticks):
+        rgb = b"".join([self.colors[value] for value in pixels])
+        for _ in range(ticks):
+            self.out.write(rgb)
+
+    def close(self):
+        self.out.flush()
+        if self.out is not sys.stdout.buffer:
+            self.out.close()
+
+def writer(path, scale=1):
+    # A writer for path: "-" for raw video on standard output, .gif, .raw
+    # or .rgb, and anything else a directory of PNGs
+    width, height = WIDTH * scale, HEIGHT * scale
+    if path == "-":
+        return RawWriter(sys.stdout.buffer)
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".gif":
+        return GifWriter(open(path, "wb"), width, height)
+    if extension in (".raw", ".rgb"):
+        return RawWriter(open(path, "wb"))
+    return PngWriter(path, width, height)
+
+class Capture:
+    # Call frame() after every emulated frame, and close() at the end
+    def __init__(self, chip, out, scale=1):
+        self.chip = chip
+        self.out = out
+        self.scale = scale
+        self.pending = render(chip, scale) # The frame showing, and for how long
+        self.ticks = 0
+        self.frames = 0 # Different frames written
+
+    def frame(self):
+        chip = self.chip
+        if chip.drawFlag:
+            chip.drawFlag = False
+            pixels = render(chip, self.scale)
+            if pixels != self.pending:
+                if self.ticks:
+                    self.out.frame(self.pending, self.ticks)
+                    self.frames += 1
+                self.pending = pixels
+                self.ticks = 0
+        self.ticks += 1
+
+    def close(self):
+        if self.ticks or not self.frames:
+            self.out.frame(self.pending, max(1, self.ticks))
+            self.frames += 1
+        self.out.close()
+
+def run_frames(chip, runner, frames, tpf, capture):
+    # run_frames(), capturing every frame
+    try:
+        for frame in range(frames):
+            if runner.run(tpf) == "exit":
+                return chip.state(frame, exited=True)
+            chip.tick_timers()
+            capture.frame()
+        return chip.state(frames)
+    finally:
+        capture.close()
@@ -1,42 +1,192 @@
 #!/usr/bin/python3
+# Octo compiler front end
+#
+# Compiles with the assembler in octo.py, in process, or with --node, the
+# bundled Octo compiler it was ported from. Compiled ROMs are cached in
+# ~/.cache/chippy/octo (or $CHIPPY_CACHE/octo) by a hash of the source and
+# of the compiler, so a source that hasn't changed is never compiled again.
+# --build compiles every .8o file in some directories, Node processes in
+# parallel, and reports each file's errors.
 
-import argparse, os, random
-parser = argparse.ArgumentParser()
-method = parser.add_mutually_exclusive_group(required=True)
-method.add_argument("-c", "--compiled", action="store_true",
-                    help="Put already-compiled code from Octo in a file")
-method.add_argument("-o", "--octocode",
-                    help="Compile Octocode .8o to a file")
-parser.add_argument("output",
-                    help="File to put output in")
-args = parser.parse_args()
-
-args.output = args.output + ("" if "." in args.output.split("/")[-1] else ".ch8")
-
-if args.compiled:
-    code = input("Please enter the compiled code: ")
-    print("Converting input...")
-    code = code.split()
-    code = [i[2:] for i in code]
-    code = [int(i, 16) for i in code]
-    code = bytes(code)
-    print("Writing to file...")
-    f = open(args.output, "wb+")
-    f.write(code)
-    f.close()
-elif args.octocode:
-    print("Reading .8o file...")
-    with open(args.octocode) as f:
+import argparse, glob, hashlib, os, subprocess, sys, tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import octo
+
+HERE = os.path.dirname(os.path.realpath(__file__))
+OCTO = os.path.join(HERE, "octo-compiler", "octo")
+CACHE_DIR = os.path.join(os.environ.get("CHIPPY_CACHE", os.path.join(
+    os.path.expanduser("~"), ".cache", "chippy")), "octo")
+
+class CompileError(Exception):
+    pass
+
+_compiler = {} # node: hash
+
+def compiler_hash(node=False):
+    # Hash of the compiler's own code, so a new compiler misses the cache
+    if node not in _compiler:
+        names = ([OCTO] + sorted(glob.glob(os.path.join(HERE, "octo-compiler", "js", "*.js")))
+                 if node else [octo.__file__])
+        digest = hashlib.sha1(b"node" if node else b"octo.py")
+        for name in names:
+            with open(name, "rb") as f:
+                digest.update(f.read())
+        _compiler[node] = digest.hexdigest()
+    return _compiler[node]
+
+def read_source(path):
+    with open(path, encoding="utf-8-sig") as f:
         code = f.read()
-        while code[0] > "\ueeee": #Octo sometimes adds strange symbols at the start
-            code = code[1:]
-    tmpFile = f".tmp_octocode_{str(random.randint(0,999999)).rjust(6, '0')}"
-    with open(tmpFile, "w+") as f:
+    while code and code[0] > "\ueeee": # Octo sometimes adds strange symbols at the start
+        code = code[1:]
+    return code
+
+def cache_path(code, node=False, directory=CACHE_DIR):
+    digest = hashlib.sha1((compiler_hash(node) + "\0" + code).encode()).hexdigest()
+    return os.path.join(directory, digest + ".ch8")
+
+def compile_code(code, node=False):
+    # The ROM for some Octo source, or raises CompileError with the
+    # compiler's message
+    if not node:
+        try:
+            return octo.assemble(code)
+        except octo.OctoError as e:
+            raise CompileError(str(e))
+    with tempfile.TemporaryDirectory(prefix="chippy-octo-") as directory:
+        source = os.path.join(directory, "source.8o")
+        target = os.path.join(directory, "rom.ch8")
+        with open(source, "w", encoding="utf-8") as f:
+            f.write(code)
+        try:
+            result = subprocess.run(["node", OCTO, source, target], capture_output=True,
+                                    text=True, env=dict(os.environ, NODE_NO_WARNINGS="1"))
+        except OSError as e:
+            raise CompileError(f"Cannot run the Octo compiler: {e}")
+        if result.returncode or not os.path.isfile(target):
+            raise CompileError(result.stderr.strip() or f"Octo exited with {result.returncode}")
+        with open(target, "rb") as f:
+            return f.read()
+
+def compile_octo(path, node=False, directory=CACHE_DIR):
+    # (ROM, whether it came from the cache) for a .8o file
+    code = read_source(path)
+    cached = cache_path(code, node, directory)
+    try:
+        with open(cached, "rb") as f:
+            return f.read(), True
+    except OSError:
+        pass
+    rom = compile_code(code, node)
+    try:
+        os.makedirs(directory, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=directory, suffix=".tmp", delete=False) as f:
+            f.write(rom)
+        os.replace(f.name, cached)
+    except OSError:
+        pass # Only the cache is lost
+    return rom, False
+
+def write_rom(rom, output):
+    # Only touch the file if it changed
+    try:
+        with open(output, "rb") as f:
+            if f.read() == rom:
+                return
+    except OSError:
+        pass
+    with open(output, "wb") as f:
+        f.write(rom)
+
+def sources(paths):
+    # The .8o files in each directory, or the paths themselves if files
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            found += sorted(glob.glob(os.path.join(path, "*.8o")))
+        else:
+            found.append(path)
+    return found
+
+def build_one(source, dest, node):
+    # (source, output, "compiled"/"cached", None) or (source, None, None, error)
+    output = os.path.join(dest or os.path.dirname(source),
+                          os.path.splitext(os.path.basename(source))[0] + ".ch8")
+    try:
+        rom, cached = compile_octo(source, node)
+        write_rom(rom, output)
+    except (OSError, UnicodeDecodeError, CompileError) as e:
+        return source, None, None, str(e)
+    return source, output, "cached" if cached else "compiled", None
+
+def build(paths, dest=None, jobs=None, node=False):
+    # Compiles every source in paths, printing how each went in order, and
+    # returns the number that failed. Only Node runs in parallel, as the
+    # assembler in octo.py holds the GIL.
+    if dest:
+        os.makedirs(dest, exist_ok=True)
+    failed = 0
+    with ThreadPoolExecutor(jobs or (os.cpu_count() if node else 1)) as pool:
+        for source, output, how, error in pool.map(lambda source: build_one(source, dest, node),
+                                                   sources(paths)):
+            if error:
+                failed += 1
+                print(f"{source}: error: {error}", file=sys.stderr)
+            else:
+                print(f"{source} -> {output} ({how})")
+    return failed
+
+def main():
+    parser = argparse.ArgumentParser()
+    method = parser.add_mutually_exclusive_group(required=True)
+    method.add_argument("-c", "--compiled", action="store_true",
+                        help="Put already-compiled code from Octo in a file")
+    method.add_argument("-o", "--octocode",
+                        help="Compile Octocode .8o to a file")
+    method.add_argument("-b", "--build", nargs="+", metavar="PATH",
+                        help="Compile every .8o file in these directories")
+    parser.add_argument("output", nargs="?",
+                        help="File to put output in")
+    parser.add_argument("-d", "--dest",
+                        help="Directory for --build to put ROMs in, instead of "
+                             "next to their sources")
+    parser.add_argument("-j", "--jobs", type=int,
+                        help="Sources for --build to compile at once")
+    parser.add_argument("--node", action="store_true",
+                        help="Compile with the bundled Octo compiler in Node")
+    args = parser.parse_args()
+
+    if args.build:
+        return 1 if build(args.build, args.dest, args.jobs, args.node) else 0
+    if not args.output:
+        parser.error("the output file is required")
+
+    args.output = args.output + ("" if "." in args.output.split("/")[-1] else ".ch8")
+
+    if args.compiled:
+        code = input("Please enter the compiled code: ")
+        print("Converting input...")
+        code = code.split()
+        code = [i[2:] for i in code]
+        code = [int(i, 16) for i in code]
+        code = bytes(code)
+        print("Writing to file...")
+        f = open(args.output, "wb+")
         f.write(code)
-    print("Running Octo compiler...")
-    os.system(
-        os.path.dirname(os.path.realpath(__file__)) +
-        f"/octo-compiler/octo {tmpFile} {args.output}"
-    )
-    os.remove(tmpFile)
-print("Done!")
+        f.close()
+    elif args.octocode:
+        print("Compiling .8o file...")
+        try:
+            rom, cached = compile_octo(args.octocode, args.node)
+        except (OSError, CompileError) as e:
+            print(f"{args.octocode}: error: {e}", file=sys.stderr)
+            return 1
+        if cached:
+            print("Unchanged, from the cache")
+        write_rom(rom, args.output)
+    print("Done!")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,747 @@
+import random
+from itertools import islice
+from operator import length_hint
+
+#4x5, 8x10 hex fontset
+from fontset import fontset
+from decoder import build_table, handlers_of, patch_table
+
+# The interpreter core shared by CHIP8, SCHIP and XOCHIP
+#
+# A profile describes a variant: which instruction sets it has and which
+# quirks it follows. Handlers for each quirk are picked once, when the
+# decode table for a profile is built, so the hot path never checks them.
+# The display handlers also depend on the resolution and the selected
+# XO-CHIP planes, so changing those swaps in another prebuilt table.
+
+PROFILES = {
+    "CHIP8": {
+        "type": "CHIP8",
+        "memory": 4096,
+        "screen": (64, 32),
+        "instructions": ("chip8",),
+        # Fx55/Fx65 leave I pointing past the registers they touched
+        "load_store_increment": False,
+        # Skipping an F000 long load skips all 4 bytes of it
+        "long_skip": False,
+        # Two drawing planes, gfx and gfx2
+        "planes": False,
+    },
+    "SCHIP": {
+        "type": "SCHIP",
+        "memory": 4096,
+        "screen": (128, 64),
+        "instructions": ("chip8", "schip"),
+        "load_store_increment": True,
+        "long_skip": False,
+        "planes": False,
+    },
+    "XO-CHIP": {
+        "type": "XO-CHIP",
+        "memory": 65536,
+        "screen": (128, 64),
+        "instructions": ("chip8", "schip", "xochip"),
+        "load_store_increment": True,
+        "long_skip": True,
+        "planes": True,
+    },
+}
+
+# The framebuffer is a list of 128 pixel rows, each packed into an int with
+# the leftmost pixel in the highest bit. It keeps the byte-per-pixel layout
+# gfx has always had: lores rows are 64 pixels wide, so two of them share
+# one packed row, the even one in the high half.
+ROW = (1 << 128) - 1
+BITS = bytes.maketrans(b"01", b"\x00\x01")
+PIXELS = bytes.maketrans(b"\x00\x01", b"01")
+
+def unpack_rows(rows):
+    # Packed rows -> one byte per pixel
+    return bytearray("".join(format(row, "0128b") for row in rows).encode().translate(BITS))
+
+def pack_rows(pixels):
+    # One byte per pixel -> packed rows
+    bits = bytes(pixels).translate(PIXELS)
+    return [int(bits[i:i+128], 2) for i in range(0, len(bits), 128)]
+
+# Instructions that only read memory, the screen and the keys, so a loop
+# made of them does exactly the same thing every time it starts from the
+# same registers
+IDLE_SAFE = {
+    "1nnn", "3xnn", "4xnn", "5xy0", "9xy0", "6xnn", "7xnn", "8xy0", "8xy1",
+    "8xy2", "8xy3", "8xy4", "8xy5", "8xy6", "8xy7", "8xyE", "Annn", "Ex9E",
+    "ExA1", "Fx07", "Fx15", "Fx18", "Fx1E", "Fx29", "Fx30", "Fx65", "F000",
+    "F002", "Fx3A",
+}
+_pure = {}
+
+FONT = bytes(fontset)
+# Memory images at power on, by (size, ROM)
+_boot = {}
+MAX_BOOT = 64
+
+def boot_image(size, cartdata):
+    # Memory as a machine starts, with the font at 0x50 and the ROM at
+    # 0x200, built once per ROM. A size of None fits memory to the ROM.
+    key = (size, cartdata)
+    if key not in _boot:
+        image = bytearray(512 + len(cartdata) if size is None else size)
+        image[80:80 + len(FONT)] = FONT
+        image[512:512 + len(cartdata)] = cartdata
+        if len(_boot) >= MAX_BOOT:
+            _boot.clear()
+        _boot[key] = bytes(image)
+    return _boot[key]
+
+class CoreError(Exception):
+    pass
+
+class Core:
+    profile = PROFILES["CHIP8"]
+    error = CoreError
+
+    def __init__(self, cartdata=bytes(), strechmem=False, seed=None, **quirks):
+        self.quirks = dict(self.profile, **quirks)
+        self.type = self.quirks["type"]
+        cartdata = bytes(cartdata)
+        if not strechmem and 512 + len(cartdata) > self.quirks["memory"]:
+            raise self.error(f"ROM is {len(cartdata)} bytes, but only "
+                             f"{self.quirks['memory'] - 512} fit in memory")
+        self.memory = bytearray(boot_image(None if strechmem else self.quirks["memory"], cartdata))
+        self.V = bytearray(16)
+        self.I = 0
+        self.pc = 512
+        width, height = self.quirks["screen"]
+        self.gfx_rows = [0] * (width*height // 128)
+        if self.quirks["planes"]:
+            self.gfx2_rows = [0] * (width*height // 128)
+
+        # 60 Hz counters, advanced by tick_timers() rather than by cycle()
+        self.delay_timer = 0
+        self.sound_timer = 0
+
+        self.keys = bytearray(16)
+
+        self.drawFlag = False
+
+        self.stack = []
+
+        self.keypress_tmp = set()
+
+        self.hires = False
+
+        self.flags = bytearray(8)
+
+        self.plane = 1
+
+        # Cxnn's random numbers, so that runs with the same seed are the same.
+        # Compiled blocks hold on to it, so reseed it rather than replace it.
+        self.rng = random.Random(seed)
+
+        # Idle loop detection: the last backward jump as (address, target),
+        # the loop being watched, and the instructions skipped so far
+        self.loop = None
+        self.idle_watch = None
+        self.skipped = 0
+
+        self.audio = b"\xF8\x3C\x1E\x0F\x07\x83\xE1\xF0" \
+                     b"\xF8\x7C\x3E\x1F\x07\x83\xC1\xE0" #440 Htz, generated with Octo
+        # Playback rate of the audio pattern, 4000 * 2 ** ((pitch - 64) / 48)
+        # bits per second
+        self.pitch = 64
+
+        self.retable()
+
+    def clone(self):
+        # An independent copy of this machine as it is now, to fork runs
+        # from one warmed up state. Block engines and profilers stay with
+        # the original.
+        other = object.__new__(self.__class__)
+        other.__dict__.update(self.__dict__)
+        other.__dict__.pop("run", None)
+        other.memory = bytearray(self.memory)
+        other.V = bytearray(self.V)
+        other.keys = bytearray(self.keys)
+        other.flags = bytearray(self.flags)
+        other.stack = list(self.stack)
+        other.keypress_tmp = set(self.keypress_tmp)
+        other.gfx_rows = list(self.gfx_rows)
+        if self.quirks["planes"]:
+            other.gfx2_rows = list(self.gfx2_rows)
+        # Without seeding it first, as setstate() replaces all of it
+        other.rng = random.Random.__new__(random.Random)
+        other.rng.setstate(self.rng.getstate())
+        return other
+
+    # gfx and gfx2 as one byte per pixel, for the renderer and anything else
+    # that reads or replaces whole frames
+
+    @property
+    def gfx(self):
+        return unpack_rows(self.gfx_rows)
+
+    @gfx.setter
+    def gfx(self, pixels):
+        self.gfx_rows = pack_rows(pixels)
+
+    @property
+    def gfx2(self):
+        if not self.quirks["planes"]:
+            raise AttributeError("gfx2")
+        return unpack_rows(self.gfx2_rows)
+
+    @gfx2.setter
+    def gfx2(self, pixels):
+        self.gfx2_rows = pack_rows(pixels)
+
+    def retable(self):
+        # Switch to the handlers for the current resolution and planes
+        self.table = specialize(self.quirks, self.hires, self.plane)
+
+    def tick_timers(self, ticks=1):
+        # Count the timers down by a number of 60 Hz ticks
+        self.delay_timer = max(0, self.delay_timer - ticks)
+        self.sound_timer = max(0, self.sound_timer - ticks)
+
+    def cycle(self, noexit=False):
+        # Get Opcode
+        opcode = self.memory[self.pc] << 8 | self.memory[self.pc + 1]
+
+        # Decode and Execute Opcode
+        handler, args = self.table[opcode]
+        if handler(self, *args) == "exit" and not noexit:
+            return "exit"
+        self.pc += 2
+
+    def run(self, count, noexit=False):
+        # Run one frame's worth of instructions, skipping ahead through idle
+        # loops. The timers and keys must not change until it returns.
+        # Returns "exit" on 00FD unless noexit.
+        memory = self.memory
+        self.idle_watch = None
+        steps = iter(range(count))
+        for _ in steps:
+            opcode = memory[self.pc] << 8 | memory[self.pc + 1]
+            handler, args = self.table[opcode]
+            signal = handler(self, *args)
+            if signal:
+                if signal == "exit":
+                    if not noexit:
+                        return "exit"
+                else:
+                    skip = self.idle(signal, length_hint(steps))
+                    next(islice(steps, skip, skip), None)
+            self.pc += 2
+
+    def idle(self, signal, remaining):
+        # Called after a backward jump ("loop") or an Fx0A that is still
+        # waiting ("wait"), with the instructions left to run. Returns how
+        # many of them can be skipped without changing anything.
+        if remaining <= 0:
+            return 0
+        if signal == "wait":
+            # Fx0A does the same thing until the keys change
+            skip = remaining
+        else:
+            snapshot = (bytes(self.V), self.I, self.delay_timer, self.sound_timer)
+            watch = self.idle_watch
+            if watch and watch[0] == self.loop and watch[1] == snapshot:
+                # Back at the same jump with the same registers, so every
+                # whole iteration from here on is the same as the last one
+                period = watch[2] - remaining
+                skip = remaining - remaining % period
+            else:
+                # Calls, returns and Bnnn clear the watch, so the next time
+                # round this jump the pc can only have moved forward, through
+                # the loop body
+                address, target = self.loop
+                pure = self.pure(target, address)
+                self.idle_watch = (self.loop, snapshot, remaining) if pure else None
+                skip = 0
+        self.skipped += skip
+        return skip
+
+    def pure(self, start, end):
+        # Whether the loop from start to the jump at end is only made of
+        # IDLE_SAFE instructions, and its forward jumps stay in step with it
+        body = bytes(self.memory[start:end + 2])
+        key = (id(self.table), start, body)
+        if key not in _pure:
+            pure = True
+            for i in range(0, len(body) - 1, 2):
+                handler, args = self.table[body[i] << 8 | body[i + 1]]
+                name = handler.__name__[3:]
+                if name not in IDLE_SAFE or name == "1nnn" and (args[0] - start) % 2:
+                    pure = False
+                    break
+            _pure[key] = pure
+        return _pure[key]
+
+    def run_frames(self, frames, tpf, noexit=False):
+        # Run the 60 Hz frame loop without a display: tpf instructions and
+        # then one timer step per frame. Stops early on 00FD unless noexit.
+        for frame in range(frames):
+            if self.run(tpf, noexit) == "exit":
+                return self.state(frame, exited=True)
+            self.tick_timers()
+        return self.state(frames)
+
+    def state(self, frames=0, exited=False):
+        # Framebuffer and registers, as plain values
+        return {
+            "type": self.type,
+            "frames": frames,
+            "exited": exited,
+            "hires": self.hires,
+            "gfx": bytes(self.gfx),
+            "gfx2": bytes(self.gfx2) if self.quirks["planes"] else None,
+            "V": bytes(self.V),
+            "I": self.I,
+            "pc": self.pc,
+            "stack": list(self.stack),
+            "delay_timer": self.delay_timer,
+            "sound_timer": self.sound_timer,
+            "skipped": self.skipped,
+        }
+
+    def op_unknown(self):
+        opcode = self.memory[self.pc] << 8 | self.memory[self.pc + 1]
+        ophex = "{:0>4}".format(hex(opcode)[2:]).upper()
+        raise self.error(f"Unknown OpCode at {hex(self.pc)}: 0x{ophex}")
+
+class Chip8Ops:
+    # Instructions every variant has
+
+    def op_00EE(self):
+        # 00EE: Return from subroutine
+        if len(self.stack) == 0:
+            raise self.error(f"Return at {hex(self.pc)} has nowhere to go")
+        self.pc = self.stack.pop() - 2
+        self.idle_watch = None
+
+    def op_1nnn(self, nnn):
+        # 1xxx: Jump to [nnn]
+        if nnn <= self.pc:
+            # Might be the end of an idle loop
+            self.loop = (self.pc, nnn)
+            self.pc = nnn - 2
+            return "loop"
+        self.pc = nnn - 2
+
+    def op_2nnn(self, nnn):
+        # 2nnn: Call subroutine at [nnn]
+        if len(self.stack) == 16:
+            raise self.error(f"Stack is full, cannot call subroutine")
+        self.stack.append(self.pc + 2)
+        self.pc = nnn - 2
+        self.idle_watch = None
+
+    def op_3xnn(self, x, nn):
+        # 3xnn: Skips next instruction if V[x] equals [nn]
+        if self.V[x] == nn:
+            self.pc += 2
+
+    def op_4xnn(self, x, nn):
+        # 4xnn: Skips next instruction if V[x] doesn't equal [nn]
+        if self.V[x] != nn:
+            self.pc += 2
+
+    def op_5xy0(self, x, y):
+        # 5xy0: Skips next instruction if V[x] equals V[y]
+        if self.V[x] == self.V[y]:
+            self.pc += 2
+
+    def op_6xnn(self, x, nn):
+        # 6xnn: Set V[x] to [nn]
+        self.V[x] = nn
+
+    def op_7xnn(self, x, nn):
+        # 7xnn: Add [nn] to V[x]
+        self.V[x] = (self.V[x] + nn) % 256
+
+    def op_8xy0(self, x, y):
+        # 8xy0: Set V[x] to V[y]
+        self.V[x] = self.V[y]
+
+    def op_8xy1(self, x, y):
+        # 8xy1: Set V[x] to V[x] OR V[y]
+        self.V[x] |= self.V[y]
+
+    def op_8xy2(self, x, y):
+        # 8xy2: Set V[x] to V[x] AND V[y]
+        self.V[x] &= self.V[y]
+
+    def op_8xy3(self, x, y):
+        # 8xy3: Set V[x] to V[x] XOR V[y]
+        self.V[x] ^= self.V[y]
+
+    def op_8xy4(self, x, y):
+        # 8xy4: Add V[y] to V[x], and set Vf to whether there was an
+        # overflow or not
+        total = self.V[x] + self.V[y]
+        self.V[x] = total % 256
+        self.V[15] = total > 256
+
+    def op_8xy5(self, x, y):
+        # 8xy7: Subtract V[y] from V[x], and set Vf to whether there was
+        # a borrow or not
+        total = self.V[x] - self.V[y]
+        self.V[x] = total % 256
+        self.V[15] = total >= 0
+
+    def op_8xy6(self, x, y):
+        # 8xy6: Shifts V[y] to the right by 1, putting the underflowflow
+        # in Vf, and putting the result in V[x]
+        self.V[15] = self.V[y] & 1
+        self.V[x] = (self.V[y]>>1)%256
+
+    def op_8xy7(self, x, y):
+        # 8xy7: Subtract V[y] from V[x], and set Vf to whether there was
+        # a borrow or not
+        total = self.V[y] - self.V[x]
+        self.V[x] = total % 256
+        self.V[15] = total >= 0
+
+    def op_8xyE(self, x, y):
+        # 8xyE: Shifts V[y] to the left by 1, putting the overflow in Vf,
+        # and putting the result in V[x]
+        self.V[15] = self.V[y]//128
+        self.V[x] = (self.V[y]<<1)%256
+
+    def op_9xy0(self, x, y):
+        # 9xy0: Skips next instruction if V[x] doesn't equal V[y]
+        if self.V[x] != self.V[y]:
+            self.pc += 2
+
+    def op_Annn(self, nnn):
+        # Annn: Set I to [nnn]
+        self.I = nnn
+
+    def op_Bnnn(self, nnn):
+        # Bnnn: Jump to [nnn] plus V0
+        self.pc = nnn + self.V[0] - 2
+        self.idle_watch = None
+
+    def op_Cxnn(self, x, nn):
+        # Cxnn: Set V[x] to a random number, and bitwise-AND it with [nn]
+        self.V[x] = self.rng.randint(0, 255) & nn
+
+    def op_Ex9E(self, x):
+        # ExA1: Skips next instruction if the key V[x] is pressed
+        if self.V[x] < 16 and self.keys[self.V[x]]:
+            self.pc += 2
+
+    def op_ExA1(self, x):
+        # ExA1: Skips next instruction if the key V[x] is not pressed
+        if self.V[x] > 15 or not self.keys[self.V[x]]:
+            self.pc += 2
+
+    def op_Fx07(self, x):
+        # Fx07: Set V[x] to delay timer
+        self.V[x] = self.delay_timer
+
+    def op_Fx15(self, x):
+        # Fx15: Set delay timer to V[x]
+        self.delay_timer = self.V[x]
+
+    def op_Fx18(self, x):
+        # Fx15: Set sound timer to V[x]
+        self.sound_timer = self.V[x]
+
+    def op_Fx0A(self, x):
+        # Fx0A: Await key press and release and store in V[x]
+        success = False
+        for i in range(16):
+            if self.keys[i]:
+                self.keypress_tmp.add(i)
+        to_remove = []
+        # The highest released key wins
+        for i in sorted(self.keypress_tmp):
+            if not self.keys[i]:
+                self.V[x] = i
+                success = True
+                to_remove.append(i)
+        for i in to_remove:
+            self.keypress_tmp.remove(i)
+        if not success:
+            self.pc -= 2
+            return "wait"
+
+    def op_Fx1E(self, x):
+        # Fx1E: Add V[x] to I, and set Vf to whether there was an overflow or not
+        total = self.I + self.V[x]
+        self.I = total % 0x1000
+        self.V[15] = total > 0xFFF
+
+    def op_Fx29(self, x):
+        # Fx29: Set I to the fontset index of the value of V[x]
+        self.I = 0x50 + (len(fontset) // 48) * (self.V[x]%16)
+
+    def op_Fx33(self, x):
+        # Fx33: Dump the 3-digit decimal representation of V[x] into
+        # memory, starting at I
+        dec = str(self.V[x]).zfill(3)
+        for i in range(3):
+            self.memory[self.I + i] = int(dec[i])
+
+    def op_Fx55(self, x):
+        # Fx55: Dump V0..V[x] into memory, starting at I
+        for i in range(x+1):
+            self.memory[self.I + i] = self.V[i]
+
+    def op_Fx65(self, x):
+        # Fx65: Load memory into V0..V[x], starting at I
+        for i in range(x+1):
+            self.V[i] = self.memory[self.I + i]
+
+class LoadStoreIncrement:
+    # Quirk: Fx55/Fx65 leave I pointing past the registers they touched
+
+    def op_Fx55(self, x):
+        # Fx55: Dump V0..V[x] into memory, starting at I
+        for i in range(x+1):
+            self.memory[self.I + i] = self.V[i]
+        self.I += x+1
+
+    def op_Fx65(self, x):
+        # Fx65: Load memory into V0..V[x], starting at I
+        for i in range(x+1):
+            self.V[i] = self.memory[self.I + i]
+        self.I += x+1
+
+class LongSkip:
+    # Quirk: skipping an F000 long load skips all 4 bytes of it
+
+    def op_3xnn(self, x, nn):
+        # 3xnn: Skips next instruction if V[x] equals [nn]
+        if self.V[x] == nn:
+            self.pc += 2
+            if self.memory[self.pc] == 0xF0 and not self.memory[self.pc + 1]:
+                self.pc += 2
+
+    def op_4xnn(self, x, nn):
+        # 4xnn: Skips next instruction if V[x] doesn't equal [nn]
+        if self.V[x] != nn:
+            self.pc += 2
+            if self.memory[self.pc] == 0xF0 and not self.memory[self.pc + 1]:
+                self.pc += 2
+
+    def op_5xy0(self, x, y):
+        # 5xy0: Skips next instruction if V[x] equals V[y]
+        if self.V[x] == self.V[y]:
+            self.pc += 2
+            if self.memory[self.pc] == 0xF0 and not self.memory[self.pc + 1]:
+                self.pc += 2
+
+    def op_9xy0(self, x, y):
+        # 9xy0: Skips next instruction if V[x] doesn't equal V[y]
+        if self.V[x] != self.V[y]:
+            self.pc += 2
+            if self.memory[self.pc] == 0xF0 and not self.memory[self.pc + 1]:
+                self.pc += 2
+
+    def op_Ex9E(self, x):
+        # ExA1: Skips next instruction if the key V[x] is pressed
+        if self.V[x] < 16 and self.keys[self.V[x]]:
+            self.pc += 2
+            if self.memory[self.pc] == 0xF0 and not self.memory[self.pc + 1]:
+                self.pc += 2
+
+    def op_ExA1(self, x):
+        # ExA1: Skips next instruction if the key V[x] is not pressed
+        if self.V[x] > 15 or not self.keys[self.V[x]]:
+            self.pc += 2
+            if self.memory[self.pc] == 0xF0 and not self.memory[self.pc + 1]:
+                self.pc += 2
+
+class SuperChipOps:
+    # SCHIP additions, besides the display ones
+
+    def op_00FD(self):
+        # 00FD: Exit
+        return "exit"
+
+    def op_00FE(self):
+        # 00FE: Set low resolution
+        self.hires = False
+        # Same as 00E0: Clear screen
+        self.gfx_rows = [0] * 64
+        if self.quirks["planes"]:
+            self.gfx2_rows = [0] * 64
+        self.drawFlag = True
+        self.retable()
+
+    def op_00FF(self):
+        # 00FF: Set high resolution
+        self.hires = True
+        # Same as 00E0: Clear screen
+        self.gfx_rows = [0] * 64
+        if self.quirks["planes"]:
+            self.gfx2_rows = [0] * 64
+        self.drawFlag = True
+        self.retable()
+
+    def op_Fx30(self, x):
+        # Fx30: Set I to the large fontset index of the value of V[x]
+        self.I = 0x50 + (len(fontset) // 48) * (16 + self.V[x]%16 * 2)
+
+    def op_Fx75(self, x):
+        # Fx75: Dump V0..V[x] into flag memory, starting at I
+        if x >= 8:
+            raise self.error(f"Flag index to high: {x}")
+        for i in range(x+1):
+            self.flags[i] = self.V[i]
+        self.I += x+1
+
+    def op_Fx85(self, x):
+        # Fx85: Load flag memory into V0..V[x<8], starting at I
+        if x >= 8:
+            raise self.error(f"Flag index to high: {x}")
+        for i in range(x+1):
+            self.V[i] = self.flags[i]
+        self.I += x+1
+
+class XOChipOps:
+    # XO-CHIP additions, besides the display ones
+
+    def op_5xy2(self, x, y):
+        # 5xy2: Dump V[x]..V[y] into memory, starting at I
+        start = x
+        for i in range(start, y+1):
+            self.memory[self.I + i - start] = self.V[i]
+        self.I += x+1-start
+
+    def op_5xy3(self, x, y):
+        # 5xy3: Load memory into V[x]..V[y], starting at I
+        start = x
+        for i in range(start, y+1):
+            self.V[i] = self.memory[self.I + i - start]
+        self.I += x+1-start
+
+    def op_F000(self):
+        # F000xxxx: Set I to xxxx
+        self.pc += 2
+        self.I = self.memory[self.pc] << 8 | self.memory[self.pc + 1]
+
+    def op_F002(self):
+        # F002: Load the 16 byte audio pattern from I
+        self.audio = bytes(self.memory[self.I:self.I + 16]).ljust(16, b"\0")
+
+    def op_Fx3A(self, x):
+        # Fx3A: Set the audio pitch to V[x]
+        self.pitch = self.V[x]
+
+    def op_Fx01(self, x):
+        # Fn01: Set drawing plane to n
+        if x > 3:
+            raise self.error(f"Plane index to high: {x}")
+        self.plane = x
+        self.retable()
+
+def display_ops(quirks, hires, plane):
+    # Display handlers for one resolution and plane selection
+    width, height = (128, 64) if hires else (64, 32)
+    count = quirks["screen"][0] * quirks["screen"][1] // 128
+    if quirks["planes"]:
+        planes = [name for bit, name in ((1, "gfx_rows"), (2, "gfx2_rows")) if plane & bit]
+    else:
+        planes = ["gfx_rows"]
+    # Sprites are only drawn onto the first selected plane
+    target = planes[0] if planes else None
+    big_sprites = "schip" in quirks["instructions"]
+    # Packed row and shift for each screen row, and the mask of one row
+    if hires:
+        places = [(y, 0) for y in range(height)]
+    else:
+        places = [(y >> 1, 64 - 64*(y & 1)) for y in range(height)]
+    line_mask = (1 << width) - 1
+
+    def op_00E0(self):
+        # 00E0: Clear screen
+        for name in planes:
+            setattr(self, name, [0] * count)
+        self.drawFlag = True
+
+    def op_Dxyn(self, x, y, n):
+        # Dxyn: XOR sprite stored at the I pointer with height [n] at [x], [y] onto display
+        flipped_on = 0
+        x, y = self.V[x] % width, self.V[y]
+        if n == 0 and big_sprites:
+            # A height 0 sprite is 16x16
+            sprite = [self.memory[self.I + sy*2] << 8 | self.memory[self.I + sy*2 + 1]
+                      for sy in range(16)]
+            bits = 16
+        else:
+            sprite = self.memory[self.I:self.I + n]
+            bits = 8
+        if target is not None:
+            rows = getattr(self, target)
+            for sy, line in enumerate(sprite):
+                if not line:
+                    continue
+                # Line the sprite row up at x, wrapping around the edge
+                line <<= width - bits
+                line = (line >> x | line << (width - x)) & line_mask
+                index, shift = places[(y + sy) % height]
+                line <<= shift
+                flipped_on |= rows[index] & line
+                rows[index] ^= line
+        self.V[15] = flipped_on != 0
+        self.drawFlag = True
+
+    def op_00Cn(self, n):
+        # 00Cx: Scroll the display down x pixels
+        if n:
+            for name in planes:
+                rows = getattr(self, name)
+                rows[:] = [0] * n + rows[:-n]
+        self.drawFlag = True
+
+    def op_00FB(self):
+        # 00FB: Scroll the display right 4 pixels
+        for name in planes:
+            rows = getattr(self, name)
+            rows[:] = [row >> 4 for row in rows]
+        self.drawFlag = True
+
+    def op_00FC(self):
+        # 00FC: Scroll the display left 4 pixels
+        for name in planes:
+            rows = getattr(self, name)
+            rows[:] = [row << 4 & ROW for row in rows]
+        self.drawFlag = True
+
+    handlers = {"00E0": op_00E0, "Dxyn": op_Dxyn}
+    if "schip" in quirks["instructions"]:
+        handlers.update({"00Cn": op_00Cn, "00FB": op_00FB, "00FC": op_00FC})
+    return handlers
+
+def handler_sets(quirks):
+    sets = [Chip8Ops]
+    if "schip" in quirks["instructions"]:
+        sets.append(SuperChipOps)
+    if "xochip" in quirks["instructions"]:
+        sets.append(XOChipOps)
+    if quirks["load_store_increment"]:
+        sets.append(LoadStoreIncrement)
+    if quirks["long_skip"]:
+        sets.append(LongSkip)
+    return sets
+
+_tables = {}
+
+def specialize(quirks, hires, plane):
+    # Decode table for a profile, resolution and plane selection, built
+    # once and then shared by every machine that uses it
+    profile = tuple(sorted(quirks.items()))
+    key = (profile, hires, plane)
+    if key not in _tables:
+        if profile not in _tables:
+            handlers = {}
+            for handler_set in handler_sets(quirks):
+                handlers.update(handlers_of(handler_set))
+            _tables[profile] = build_table(handlers, Core.op_unknown)
+        _tables[key] = patch_table(
+            list(_tables[profile]), display_ops(quirks, hires, plane)
+        )
+    return _tables[key]
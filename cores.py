@@ -0,0 +1,14 @@
+# The machines, by the names --core takes, and what every tool that runs
+# them needs, without pulling in main.py's command line and everything it
+# imports
+
+from chip import CHIP8
+from SChip import SCHIP
+from XOChip import XOCHIP
+
+TPF = 200 # Ticks per Frame
+CORES = {"chip8": CHIP8, "schip": SCHIP, "xochip": XOCHIP}
+
+def loadfile(filename):
+    with open(filename, "rb") as f:
+        return f.read()
@@ -0,0 +1,70 @@
+# Opcode decoding shared by the interpreter cores
+#
+# Handlers are methods named after the opcode pattern they implement, e.g.
+# op_8xy4 or op_Dxyn. Uppercase hex digits in the name are fixed, while
+# x, y and runs of n are operands that get passed to the handler. Every
+# possible opcode is decoded once into a 65536-entry table of
+# (handler, operands), so executing an instruction is a single lookup.
+
+def parse_pattern(pattern):
+    # Returns (mask, value, [(operand, shift, bits), ...])
+    mask = value = 0
+    fields = []
+    i = 0
+    while i < 4:
+        char = pattern[i]
+        shift = (3 - i) * 4
+        if char in "xy":
+            fields.append((char, shift, 0xF))
+            i += 1
+        elif char == "n":
+            length = len(pattern[i:]) - len(pattern[i:].lstrip("n"))
+            shift = (4 - i - length) * 4
+            fields.append(("n" * length, shift, (1 << (length * 4)) - 1))
+            i += length
+        else:
+            mask |= 0xF << shift
+            value |= int(char, 16) << shift
+            i += 1
+    return mask, value, fields
+
+def matching(mask, value):
+    # Every opcode that matches value on the bits in mask
+    free = [shift for shift in range(0, 16, 4) if not mask & (0xF << shift)]
+    opcodes = [value]
+    for shift in free:
+        opcodes = [op | (nibble << shift) for op in opcodes for nibble in range(16)]
+    return opcodes
+
+def handlers_of(cls):
+    # Collect {pattern: function} from the op_ methods of cls and its bases
+    handlers = {}
+    for klass in reversed(cls.__mro__):
+        for name, func in vars(klass).items():
+            if name.startswith("op_") and len(name) == 7 and callable(func):
+                handlers[name[3:]] = func
+    return handlers
+
+def patch_table(table, handlers):
+    # Decode handlers into table, which is changed in place
+    decoded = []
+    for pattern, func in handlers.items():
+        mask, value, fields = parse_pattern(pattern)
+        decoded.append((mask, value, fields, func))
+    # Fill in the most general patterns first, so more specific ones win
+    decoded.sort(key=lambda entry: bin(entry[0]).count("1"))
+    for mask, value, fields, func in decoded:
+        opcodes = matching(mask, value)
+        if not fields:
+            for opcode in opcodes:
+                table[opcode] = (func, ())
+            continue
+        # Each field of every opcode, zipped up into the operand tuples
+        operands = zip(*[[(opcode >> shift) & bits for opcode in opcodes]
+                         for _, shift, bits in fields])
+        for opcode, args in zip(opcodes, operands):
+            table[opcode] = (func, args)
+    return table
+
+def build_table(handlers, unknown):
+    return patch_table([(unknown, ())] * 65536, handlers)
@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+# Disassembler and control flow analysis
+#
+# analyze() follows every path from 0x200 through a ROM, decoding with the
+# same tables the cores run on, so each variant's instruction set and
+# quirks apply: XO-CHIP's F000 nnnn is 4 bytes long and is skipped whole.
+# The instructions it reaches are split into basic blocks, with the calls
+# and the Bnnn jump tables between them. Whatever part of the ROM is never
+# reached is data, such as sprites.
+#
+# cached() keeps the results on disk, keyed by a hash of the ROM, so tools
+# and the block engine can start from them without analysing again.
+
+import argparse, hashlib, json, os, sys
+from collections import namedtuple
+
+from decoder import parse_pattern
+from cores import CORES, loadfile
+
+VERSION = 1 # Of the analysis, so older cache entries are redone
+CACHE_DIR = os.environ.get("CHIPPY_CACHE",
+                           os.path.join(os.path.expanduser("~"), ".cache", "chippy"))
+ENTRY = 0x200
+
+# Octo syntax for each instruction
+MNEMONICS = {
+    "00E0": "clear",
+    "00EE": "return",
+    "00Cn": "scroll-down {n}",
+    "00FB": "scroll-right",
+    "00FC": "scroll-left",
+    "00FD": "exit",
+    "00FE": "lores",
+    "00FF": "hires",
+    "1nnn": "jump {nnn:#05x}",
+    "2nnn": ":call {nnn:#05x}",
+    "3xnn": "if v{x:X} != {nn:#04x} then",
+    "4xnn": "if v{x:X} == {nn:#04x} then",
+    "5xy0": "if v{x:X} != v{y:X} then",
+    "5xy2": "save v{x:X} - v{y:X}",
+    "5xy3": "load v{x:X} - v{y:X}",
+    "6xnn": "v{x:X} := {nn:#04x}",
+    "7xnn": "v{x:X} += {nn:#04x}",
+    "8xy0": "v{x:X} := v{y:X}",
+    "8xy1": "v{x:X} |= v{y:X}",
+    "8xy2": "v{x:X} &= v{y:X}",
+    "8xy3": "v{x:X} ^= v{y:X}",
+    "8xy4": "v{x:X} += v{y:X}",
+    "8xy5": "v{x:X} -= v{y:X}",
+    "8xy6": "v{x:X} >>= v{y:X}",
+    "8xy7": "v{x:X} =- v{y:X}",
+    "8xyE": "v{x:X} <<= v{y:X}",
+    "9xy0": "if v{x:X} == v{y:X} then",
+    "Annn": "i := {nnn:#05x}",
+    "Bnnn": "jump0 {nnn:#05x}",
+    "Cxnn": "v{x:X} := random {nn:#04x}",
+    "Dxyn": "sprite v{x:X} v{y:X} {n}",
+    "Ex9E": "if v{x:X} -key then",
+    "ExA1": "if v{x:X} key then",
+    "F000": "i := long {long:#06x}",
+    "Fx01": "plane {x}",
+    "F002": "audio",
+    "Fx07": "v{x:X} := delay",
+    "Fx0A": "v{x:X} := key",
+    "Fx15": "delay := v{x:X}",
+    "Fx18": "buzzer := v{x:X}",
+    "Fx1E": "i += v{x:X}",
+    "Fx29": "i := hex v{x:X}",
+    "Fx30": "i := bighex v{x:X}",
+    "Fx33": "bcd v{x:X}",
+    "Fx3A": "pitch := v{x:X}",
+    "Fx55": "save v{x:X}",
+    "Fx65": "load v{x:X}",
+    "Fx75": "saveflags v{x:X}",
+    "Fx85": "loadflags v{x:X}",
+}
+
+# Instructions that skip the next one
+SKIPS = {"3xnn", "4xnn", "5xy0", "9xy0", "Ex9E", "ExA1"}
+# Instructions after which execution doesn't go on to the next one
+ENDS = {"00EE", "00FD", "1nnn", "Bnnn", "unknown"}
+# Longest Bnnn jump table looked for, in entries
+MAX_TABLE = 128
+
+Instruction = namedtuple("Instruction", "address size opcode name fields text")
+Block = namedtuple("Block", "start end successors")
+
+def decode(chip, address):
+    memory = chip.memory
+    opcode = memory[address] << 8 | memory[address + 1]
+    handler, args = chip.table[opcode]
+    name = handler.__name__[3:]
+    size = 2
+    if name == "unknown":
+        return Instruction(address, size, opcode, name, {}, f"0x{opcode >> 8:02X} 0x{opcode & 0xFF:02X}")
+    fields = dict(zip([field for field, _, _ in parse_pattern(name)[2]], args))
+    if name == "F000":
+        size = 4
+        fields["long"] = memory[address + 2] << 8 | memory[address + 3] if address + 3 < len(memory) else 0
+    return Instruction(address, size, opcode, name, fields, MNEMONICS[name].format(**fields))
+
+class Analysis:
+    def __init__(self, variant, size):
+        self.variant = variant
+        self.size = size # Of the ROM
+        self.code = [] # Addresses of every reachable instruction
+        self.blocks = {} # start: Block
+        self.calls = set() # Subroutine addresses
+        self.tables = {} # Bnnn address: [jump table entries]
+        self.sprites = set() # Addresses I is set to inside the ROM
+        self.invalid = set() # Reachable addresses that don't decode
+        self.data = [] # (start, end) of unreached parts of the ROM
+
+    def to_json(self):
+        return {
+            "version": VERSION,
+            "variant": self.variant,
+            "size": self.size,
+            "code": self.code,
+            "blocks": [list(block) for block in self.blocks.values()],
+            "calls": sorted(self.calls),
+            "tables": {str(address): entries for address, entries in self.tables.items()},
+            "sprites": sorted(self.sprites),
+            "invalid": sorted(self.invalid),
+            "data": self.data,
+        }
+
+    @classmethod
+    def from_json(cls, data):
+        analysis = cls(data["variant"], data["size"])
+        analysis.code = data["code"]
+        analysis.blocks = {start: Block(start, end, successors)
+                           for start, end, successors in data["blocks"]}
+        analysis.calls = set(data["calls"])
+        analysis.tables = {int(address): entries for address, entries in data["tables"].items()}
+        analysis.sprites = set(data["sprites"])
+        analysis.invalid = set(data["invalid"])
+        analysis.data = [tuple(span) for span in data["data"]]
+        return analysis
+
+def jump_table(chip, base):
+    # The jumps a Bnnn can land on: an Octo style table of jumps at nnn, or
+    # just nnn itself if there is no such table
+    entries = []
+    address = base
+    while len(entries) < MAX_TABLE and address + 1 < len(chip.memory):
+        if decode(chip, address).name != "1nnn":
+            break
+        entries.append(address)
+        address += 2
+    return entries or [base]
+
+def analyze(cartdata, variant):
+    chip = CORES[variant](cartdata)
+    limit = len(chip.memory) - 1
+    end = ENTRY + len(cartdata)
+    analysis = Analysis(variant, len(cartdata))
+    instructions = {}
+    edges = {} # address: successors, for instructions that end a block
+    leaders = {ENTRY}
+    todo = [ENTRY]
+    while todo:
+        address = todo.pop()
+        if address in instructions or not 0 <= address < limit:
+            continue
+        instruction = decode(chip, address)
+        instructions[address] = instruction
+        name, fields = instruction.name, instruction.fields
+        following = address + instruction.size
+        if name == "unknown":
+            analysis.invalid.add(address)
+        if name == "Annn" and ENTRY <= fields["nnn"] < end:
+            analysis.sprites.add(fields["nnn"])
+        elif name == "F000" and ENTRY <= fields["long"] < end:
+            analysis.sprites.add(fields["long"])
+
+        targets = []
+        if name == "1nnn":
+            targets = [fields["nnn"]]
+        elif name == "2nnn":
+            analysis.calls.add(fields["nnn"])
+            targets = [fields["nnn"], following]
+        elif name == "Bnnn":
+            targets = analysis.tables[address] = jump_table(chip, fields["nnn"])
+        elif name in SKIPS:
+            skipped = following + 2
+            if following < limit and decode(chip, following).name == "F000":
+                skipped += 2
+            targets = [following, skipped]
+        elif name not in ENDS:
+            todo.append(following)
+            continue
+        edges[address] = targets
+        leaders.update(targets)
+        todo += targets
+
+    analysis.code = sorted(instructions)
+    # Split into basic blocks at every leader and after every branch
+    start = None
+    for index, address in enumerate(analysis.code):
+        if start is None or address in leaders:
+            start = address
+        instruction = instructions[address]
+        following = address + instruction.size
+        last = (address in edges or index + 1 == len(analysis.code)
+                or analysis.code[index + 1] != following or following in leaders)
+        if last:
+            successors = edges.get(address)
+            if successors is None:
+                successors = [following] if following in instructions else []
+            analysis.blocks[start] = Block(start, following, successors)
+            start = None
+
+    covered = bytearray(len(cartdata))
+    for address, instruction in instructions.items():
+        for i in range(address, address + instruction.size):
+            if ENTRY <= i < end:
+                covered[i - ENTRY] = 1
+    start = None
+    for i in range(len(cartdata) + 1):
+        if i < len(cartdata) and not covered[i]:
+            if start is None:
+                start = i
+        elif start is not None:
+            analysis.data.append((ENTRY + start, ENTRY + i))
+            start = None
+    return analysis
+
+def cache_path(cartdata, variant, directory=CACHE_DIR):
+    digest = hashlib.sha1(cartdata).hexdigest()
+    return os.path.join(directory, f"{digest}-{variant}.json")
+
+def cached(cartdata, variant, directory=CACHE_DIR):
+    # analyze(), from the cache if it has been run on this ROM before
+    path = cache_path(cartdata, variant, directory)
+    try:
+        with open(path) as f:
+            data = json.load(f)
+        if data["version"] == VERSION:
+            return Analysis.from_json(data)
+    except (OSError, ValueError, KeyError):
+        pass
+    analysis = analyze(cartdata, variant)
+    try:
+        os.makedirs(directory, exist_ok=True)
+        with open(path + ".tmp", "w") as f:
+            json.dump(analysis.to_json(), f)
+        os.replace(path + ".tmp", path)
+    except OSError:
+        pass # Not being able to cache only costs time
+    return analysis
+
+def listing(cartdata, analysis):
+    # Octo style listing of the ROM, with the blocks and data marked
+    chip = CORES[analysis.variant](cartdata)
+    lines = []
+    starts = {start: "data" for start, end in analysis.data}
+    starts.update({start: "block" for start in analysis.blocks})
+    data = dict(analysis.data)
+    code = set(analysis.code)
+    address = ENTRY
+    end = ENTRY + len(cartdata)
+    while address < end:
+        kind = starts.get(address)
+        if kind == "block":
+            block = analysis.blocks[address]
+            notes = ["entry"] if address == ENTRY else []
+            if address in analysis.calls:
+                notes.append("subroutine")
+            notes.append("-> " + ", ".join(f"{target:#05x}" for target in block.successors)
+                         if block.successors else "-> nothing")
+            lines.append(f"# {address:#05x} " + " ".join(notes))
+        if address in code:
+            instruction = decode(chip, address)
+            raw = chip.memory[address:address + instruction.size].hex().upper()
+            lines.append(f"{address:#06x}  {raw:8}  {instruction.text}")
+            address += instruction.size
+        elif kind == "data":
+            # Eight bytes a line, starting a new line at each sprite
+            span_end = data[address]
+            row = address
+            while row < span_end:
+                if row == address or row in analysis.sprites:
+                    lines.append(f"# {row:#05x} " + ("sprite" if row in analysis.sprites else "data"))
+                stop = min(row + 8, span_end)
+                stop = min([sprite for sprite in analysis.sprites if row < sprite < stop] + [stop])
+                lines.append(f"{row:#06x}  " + " ".join(f"0x{byte:02X}" for byte in chip.memory[row:stop]))
+                row = stop
+            address = span_end
+        else:
+            # The middle of an instruction that overlaps another
+            address += 1
+    return "\n".join(lines)
+
+def dot(analysis):
+    # Graphviz source for the control flow graph
+    lines = ["digraph cfg {", "  node [shape=box fontname=monospace];"]
+    for block in analysis.blocks.values():
+        lines.append(f'  b{block.start} [label="{block.start:#05x}-{block.end - 1:#05x}"];')
+        for target in block.successors:
+            style = " [style=dashed]" if target in analysis.calls else ""
+            lines.append(f"  b{block.start} -> b{target}{style};")
+    lines.append("}")
+    return "\n".join(lines)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("filename",
+                        help="ROM to disassemble")
+    parser.add_argument("--core", choices=CORES, default="xochip",
+                        help="Interpreter whose instruction set to decode with")
+    parser.add_argument("--dot", action="store_true",
+                        help="Print the control flow graph in Graphviz format instead")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Analyse again instead of using the cache")
+    args = parser.parse_args()
+
+    cartdata = loadfile(args.filename)
+    if args.no_cache:
+        analysis = analyze(cartdata, args.core)
+    else:
+        analysis = cached(cartdata, args.core)
+    print(dot(analysis) if args.dot else listing(cartdata, analysis))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,105 @@
+# SCHIP/XO-CHIP flag register storage
+#
+# Flags are kept in one SQLite database, by the SHA-1 of the ROM they belong
+# to, so they follow the ROM wherever it is and many processes can share
+# the database at once. It runs in WAL mode, so readers never wait for a
+# writer, and writers wait their turn for up to TIMEOUT seconds. Changes
+# are queued and written together at most every INTERVAL seconds, and
+# once a write is committed it survives the process crashing.
+#
+# The <rom>.flags pickles earlier versions saved next to ROMs are read in
+# once, the first time a ROM without stored flags is opened.
+
+import hashlib, os, pickle, sqlite3, time
+
+PATH = os.environ.get("CHIPPY_FLAGS", os.path.join(
+    os.path.expanduser("~"), ".local", "share", "chippy", "flags.sqlite3"))
+INTERVAL = 1.0 # Seconds between writes
+TIMEOUT = 30.0 # Seconds to wait for another process's write
+SIZE = 8 # Flag registers
+TYPES = ("SCHIP", "XO-CHIP") # Machines that have them
+
+def rom_key(cartdata):
+    return hashlib.sha1(cartdata).hexdigest()
+
+class FlagStore:
+    def __init__(self, path=PATH, interval=INTERVAL):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.db = sqlite3.connect(path, timeout=TIMEOUT)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        with self.db:
+            self.db.execute("CREATE TABLE IF NOT EXISTS flags "
+                            "(rom TEXT PRIMARY KEY, flags BLOB NOT NULL, updated REAL NOT NULL)")
+        self.interval = interval
+        self.pending = {} # rom: flags, not written yet
+        self.written = time.monotonic()
+
+    def load(self, rom):
+        # The flags stored for a ROM, or None
+        if rom in self.pending:
+            return self.pending[rom]
+        row = self.db.execute("SELECT flags FROM flags WHERE rom = ?", (rom,)).fetchone()
+        return row and bytes(row[0])
+
+    def save(self, rom, flags):
+        # Queue the flags of a ROM, and write everything queued if it is time
+        self.pending[rom] = bytes(flags)
+        self.commit()
+
+    def commit(self, force=False):
+        if not self.pending or not force and time.monotonic() - self.written < self.interval:
+            return
+        now = time.time()
+        with self.db:
+            self.db.executemany("INSERT OR REPLACE INTO flags VALUES (?, ?, ?)",
+                                [(rom, flags, now) for rom, flags in self.pending.items()])
+        self.pending.clear()
+        self.written = time.monotonic()
+
+    def close(self):
+        self.commit(force=True)
+        self.db.close()
+
+    def migrate(self, rom, path):
+        # Read in an old pickled flags file for a ROM that has nothing
+        # stored, and rename it so it isn't read again
+        if not os.path.isfile(path) or self.load(rom) is not None:
+            return
+        try:
+            with open(path, "rb") as f:
+                flags = bytes(pickle.load(f))
+        except (OSError, pickle.UnpicklingError, EOFError, TypeError, ValueError):
+            return
+        if len(flags) == SIZE:
+            self.save(rom, flags)
+            self.commit(force=True)
+            os.replace(path, path + ".migrated")
+
+class RomFlags:
+    # The flags of one ROM file in a store, written whenever they change
+    def __init__(self, filename, store=None):
+        with open(filename, "rb") as f:
+            self.rom = rom_key(f.read())
+        self.owned = store is None
+        self.store = store or FlagStore()
+        self.store.migrate(self.rom, filename + ".flags")
+        self.last = self.store.load(self.rom) or bytes(SIZE)
+
+    def load(self):
+        return bytearray(self.last)
+
+    def update(self, flags):
+        # Call once a frame with the machine's flags
+        if flags != self.last:
+            self.last = bytes(flags)
+            self.store.save(self.rom, self.last)
+        else:
+            self.store.commit()
+
+    def close(self):
+        if self.owned:
+            self.store.close()
+        else:
+            self.store.commit(force=True)
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# Fleet runner
+#
+# Runs many (ROM, variant, seed, input script, cycle budget) jobs headlessly
+# across a process pool, and streams each result back as it finishes.
+# Input scripts are text files with one "FRAME KEYS" line per change of key
+# state, where KEYS is the hex mask of the keys held down from that frame on:
+#
+#   0   0000
+#   30  0020
+#   45  0000
+#
+# Every job starts with the flag registers cleared and saves nothing, so
+# its result only depends on the job. With --flags, SCHIP and XO-CHIP jobs
+# start with the flags stored for their ROM and save them when they end,
+# like any other run, through one connection to the flag store per worker.
+# Results then depend on earlier runs and on the order jobs finish in.
+
+import argparse, concurrent.futures, hashlib, json, os
+from collections import namedtuple
+
+from cores import CORES, TPF
+from flagstore import TYPES as FLAG_TYPES, FlagStore, RomFlags
+
+Job = namedtuple("Job", "rom variant seed script cycles")
+
+# Per-worker caches, so each process reads a ROM or script only once
+_roms = {}
+_scripts = {}
+_store = None
+
+def load_rom(path):
+    if path not in _roms:
+        with open(path, "rb") as f:
+            _roms[path] = f.read()
+    return _roms[path]
+
+def load_script(path):
+    # [(frame, keymask), ...] sorted by frame
+    if path is None:
+        return []
+    if path not in _scripts:
+        events = []
+        with open(path) as f:
+            for line in f:
+                if line.strip() and not line.lstrip().startswith("#"):
+                    frame, keys = line.split()
+                    events.append((int(frame), int(keys, 16)))
+        _scripts[path] = sorted(events)
+    return _scripts[path]
+
+def flag_store():
+    global _store
+    if _store is None:
+        _store = FlagStore()
+    return _store
+
+def state_hash(chip):
+    digest = hashlib.sha1()
+    for part in (chip.V, chip.memory, chip.gfx, getattr(chip, "gfx2", b"")):
+        digest.update(part)
+    digest.update(b"".join(address.to_bytes(4, "big") for address in chip.stack))
+    digest.update(f"{chip.I},{chip.pc},{chip.hires},{chip.plane},"
+                  f"{chip.delay_timer},{chip.sound_timer}".encode())
+    return digest.hexdigest()
+
+def run_job(job, tpf=TPF, flags=False):
+    result = {"job": job._asdict(), "hash": None, "frames": 0, "error": None}
+    chip = None
+    stored = None
+    frame = 0 # Frames run to the end, counted as they go so errors report it
+    try:
+        chip = CORES[job.variant](load_rom(job.rom), seed=job.seed)
+        if flags and chip.type in FLAG_TYPES:
+            stored = RomFlags(job.rom, flag_store())
+            chip.flags = stored.load()
+        events = load_script(job.script)
+        frames = job.cycles // tpf
+        for start, keys in events + [(frames, None)]:
+            end = min(start, frames)
+            while frame < end and chip.run(tpf) != "exit":
+                chip.tick_timers()
+                frame += 1
+            if frame < end or frame >= frames:
+                break
+            if keys is not None:
+                for key in range(16):
+                    chip.keys[key] = keys >> key & 1
+        result["hash"] = state_hash(chip)
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+        if chip is not None:
+            result["hash"] = state_hash(chip)
+    if stored:
+        stored.update(chip.flags)
+        stored.close()
+    result["frames"] = frame
+    return result
+
+def run_fleet(jobs, workers=None, tpf=TPF, flags=False):
+    # Yields results in the order the jobs finish
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        futures = [pool.submit(run_job, job, tpf, flags) for job in jobs]
+        for future in concurrent.futures.as_completed(futures):
+            yield future.result()
+
+def parse_seeds(text):
+    # "7", "0-99" or "1,5,9"
+    seeds = []
+    for part in text.split(","):
+        if "-" in part:
+            start, end = part.split("-")
+            seeds += range(int(start), int(end) + 1)
+        else:
+            seeds.append(int(part))
+    return seeds
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("roms", nargs="+",
+                        help="ROMs to run")
+    parser.add_argument("--variants", nargs="+", choices=CORES,
+                        default=["xochip"],
+                        help="Interpreters to run each ROM on")
+    parser.add_argument("--seeds", type=parse_seeds, default=[0],
+                        help="RNG seeds, e.g. 0-99 or 1,5,9")
+    parser.add_argument("--scripts", nargs="+", default=[None],
+                        help="Input scripts to run each ROM with")
+    parser.add_argument("--cycles", type=int, default=TPF*600,
+                        help="Instructions to run per job")
+    parser.add_argument("--cycles-per-frame", type=int, default=TPF,
+                        help="Instructions to run per frame")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="Worker processes")
+    parser.add_argument("--flags", action="store_true",
+                        help="Load and save the flag registers in the shared "
+                             "flag store, instead of starting every job with "
+                             "them cleared")
+    args = parser.parse_args()
+
+    jobs = [Job(rom, variant, seed, script, args.cycles)
+            for rom in args.roms
+            for variant in args.variants
+            for seed in args.seeds
+            for script in args.scripts]
+    for result in run_fleet(jobs, args.workers, args.cycles_per_frame, args.flags):
+        print(json.dumps(result), flush=True)
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,37 @@
-#4x5 hex fontset
-small = [i.lstrip("\n") for i in [ #Strip leading \n
+#4x5 and 8x10 hex fontsets
+#
+# fontset is the bytes of the glyphs drawn below, written out so importing
+# this doesn't have to parse the drawings. After changing a drawing, run
+# this file to print the new bytes.
+
+fontset = bytes.fromhex(
+    "6090909060 2060A020F0"
+    "60902040F0 E010E010E0"
+    "9090F01010 F080F010E0"
+    "6080F09060 F010204080"
+    "6090609060 6090701060"
+    "6090F09090 E090E090E0"
+    "7080808070 E0909090E0"
+    "F080F080F0 F080F08080"
+    "3C7EE7C3C3C3C3E77E3C"
+    "3878F8D818181818FFFF"
+    "3C7EE7C70E1C3870FFFF"
+    "FCFE0707FEFE0707FEFC"
+    "C3C3C3C3FFFF03030303"
+    "FFFFC0C0FCFE0707FEFC"
+    "3E7EE0C0FCFEE7E77E3C"
+    "FFFF03070E1C3870E0C0"
+    "3C7EE7E77E7EE7E77E3C"
+    "3C7EE7E77F3F07073E3C"
+    "3C7EE7C3FFFFC3C3C3C3"
+    "FCFEC7C7FEFEC7C7FEFC"
+    "3F7FE0C0C0C0C0E07F3F"
+    "FCFEC7C3C3C3C3C7FEFC"
+    "FFFFC0C0FFFFC0C0FFFF"
+    "FFFFC0C0FFFFC0C0C0C0"
+)
+
+small = [
 """
  ** 
 *  *
@@ -111,15 +143,9 @@ small = [i.lstrip("\n") for i in [ #Strip leading \n
 ****
 *   
 *   """,
-]]
-fontset = bytearray()
+]
 
-for char in small:
-    for line in char.split("\n"):
-        byte = int(line[:4].ljust(4, "0").replace(" ", "0").replace("*", "1"),2)*16
-        fontset.append(byte)
-
-large = [i.lstrip("\n") for i in [ #Strip leading \n
+large = [
 """
   **** 
  ******
@@ -311,9 +337,25 @@ large = [i.lstrip("\n") for i in [ #Strip leading \n
 **      
 **      
 **      """,
-]]
+]
+
+def draw():
+    # The bytes of the drawings, small then large glyphs
+    font = bytearray()
+    for char in small:
+        for line in char.lstrip("\n").split("\n"):
+            byte = int(line[:4].ljust(4, "0").replace(" ", "0").replace("*", "1"),2)*16
+            font.append(byte)
+    for char in large:
+        for line in char.lstrip("\n").split("\n"):
+            byte = int(line[:8].ljust(8, "0").replace(" ", "0").replace("*", "1"),2)
+            font.append(byte)
+    return bytes(font)
 
-for char in large:
-    for line in char.split("\n"):
-        byte = int(line[:8].ljust(8, "0").replace(" ", "0").replace("*", "1"),2)
-        fontset.append(byte)
\ No newline at end of file
+if __name__ == "__main__":
+    font = draw()
+    if font == fontset:
+        print("fontset matches the drawings")
+    else:
+        print("fontset doesn't match the drawings, it should be:")
+        print(font.hex().upper())
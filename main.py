@@ -6,40 +6,16 @@ try:
 except ImportError:
     pass
 
-import pygame, re, sys, random, os, pickle
-import pygame.locals as plocals
+import sys, argparse, contextlib, random
 
-if len(sys.argv) > 1:
-    filename = sys.argv[1]
-else:
-    print("Usage: %s [filename]" % sys.argv[0])
-    sys.exit(1)
+from cores import CORES, TPF, loadfile
+from core import CoreError
+from flagstore import TYPES as FLAG_TYPES, RomFlags
+from blocks import BlockEngine
+from speed import MODES, SpeedController
+from profiler import Profiler
+import record
 
-OFF_COLOR =     ( 20, 50, 80)
-FG1_COLOR =     (100,255,100)
-FG2_COLOR =     (255,100,100)
-BLENDED_COLOR = (255,255,100)
-PIX_SIZE = 20
-TPF = 200 # Ticks per Frame
-FPS = 60 # Frames per Second
-KEYMAP = {
-    plocals.K_1: 0x1, plocals.K_2: 0x2, plocals.K_3: 0x3, plocals.K_4: 0xC,
-    plocals.K_q: 0x4, plocals.K_w: 0x5, plocals.K_e: 0x6, plocals.K_r: 0xD,
-    plocals.K_a: 0x7, plocals.K_s: 0x8, plocals.K_d: 0x9, plocals.K_f: 0xE,
-    plocals.K_z: 0xA, plocals.K_x: 0x0, plocals.K_c: 0xB, plocals.K_v: 0xF,
-    
-    plocals.K_SPACE: 0x6,
-    
-                         plocals.K_UP:   0x5,
-    plocals.K_LEFT: 0x7, plocals.K_DOWN: 0x8, plocals.K_RIGHT: 0x9,
-}
-
-pygame.mixer.init(44100, -16, 1, 64)
-pygame.init()
-win = pygame.display.set_mode((64*PIX_SIZE,32*PIX_SIZE))
-pygame.display.set_caption("Chippy")
-
-from XOChip import CHIP8, CHIP8Error
 def printmem(chip):
     for i in range(0, 4096, 16):
         tmp = ""
@@ -47,81 +23,142 @@ def printmem(chip):
             tmp += hex(j) + "\t"
         print(tmp)
 
-def draw(chip, win):
-    hires = chip.type in ["SCHIP", "XO-CHIP"] and chip.hires
-    for i in range(64*32*(4 if hires else 1)):
-        if hires:
-            pix_rect = (
-                i%128*(PIX_SIZE/2), i//128*(PIX_SIZE/2),
-                (PIX_SIZE/2), (PIX_SIZE/2)
-            )
-        else:
-            pix_rect = (
-                i%64*PIX_SIZE, i//64*PIX_SIZE,
-                PIX_SIZE, PIX_SIZE
-            )
-        if chip.gfx[i]:
-            color = FG1_COLOR
-        else:
-            color = OFF_COLOR
-        if chip.type == "XO-CHIP" and chip.gfx2[i]:
-            color = (FG2_COLOR if color == OFF_COLOR else BLENDED_COLOR)
-        pygame.draw.rect(win, color, pix_rect)
-    pygame.display.update()
+def printstate(state):
+    print(f"Frames: {state['frames']}" + (" (exited)" if state["exited"] else ""))
+    print(f"PC: {hex(state['pc'])}\tI: {hex(state['I'])}")
+    print(f"Idle instructions skipped: {state['skipped']}")
+    print("V: " + " ".join(f"{v:02X}" for v in state["V"]))
+    width, height = (128, 64) if state["hires"] else (64, 32)
+    gfx2 = state["gfx2"] or bytes(len(state["gfx"]))
+    for y in range(height):
+        row = range(y*width, (y+1)*width)
+        print("".join(" #*@"[state["gfx"][i] | gfx2[i] << 1] for i in row))
 
-def loadfile(filename):
-    f = open(filename, "rb")
-    return f.read()
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("filename",
+                        help="ROM to run")
+    parser.add_argument("--core", choices=CORES, default="xochip",
+                        help="Interpreter to run the ROM on")
+    parser.add_argument("--blocks", action="store_true",
+                        help="Run through the basic block translation cache")
+    parser.add_argument("--headless", action="store_true",
+                        help="Run without a window, and print the final state")
+    parser.add_argument("--frames", type=int, default=60,
+                        help="Frames to run in headless mode")
+    parser.add_argument("--cycles-per-frame", type=int, default=TPF,
+                        help="Instructions to run per frame")
+    parser.add_argument("--speed", choices=MODES, default="fixed",
+                        help="Run at a fixed speed, as fast as the host "
+                             "allows while keeping the frame rate, or "
+                             "unthrottled")
+    parser.add_argument("--ips", type=int,
+                        help="Instructions per second for --speed fixed "
+                             "(default: cycles per frame * 60)")
+    parser.add_argument("--seed", type=int,
+                        help="Seed for the random numbers of Cxnn")
+    parser.add_argument("--record", metavar="LOG",
+                        help="Record the seed and keys to LOG, for --replay")
+    parser.add_argument("--replay", metavar="LOG",
+                        help="Replay a recording headlessly, as fast as possible")
+    parser.add_argument("--capture", metavar="OUT",
+                        help="With --headless, record the screen to OUT: a .gif, "
+                             "a directory of PNGs, or raw RGB video in a .raw "
+                             "file or on standard output for -")
+    parser.add_argument("--scale", type=int, default=4,
+                        help="Size of a hires pixel in captured frames")
+    parser.add_argument("--serve", metavar="ADDRESS",
+                        help="Run without a window in real time, and stream the "
+                             "screen to viewers on a socket: unix:PATH or HOST:PORT")
+    parser.add_argument("--no-flags", action="store_true",
+                        help="Start with the flag registers cleared, and don't "
+                             "save them")
+    parser.add_argument("--profile", nargs="?", const=True, metavar="JSON",
+                        help="Count and time every instruction, print a report "
+                             "and heat map at the end, and save the counts to JSON")
+    args = parser.parse_args()
+    if args.profile and args.blocks:
+        parser.error("--profile only works on the interpreter, not with --blocks")
+    if args.capture and not args.headless:
+        parser.error("--capture only works with --headless")
+    if args.serve:
+        import stream
+        try:
+            stream.parse_address(args.serve)
+        except ValueError as e:
+            parser.error(str(e))
 
-c = CHIP8(loadfile(filename)) #bytes([0x60, 0x01, 0x61, 0x01, 0x60, 0x00, 0x61, 0x00, 0x12, 0x00]))
-# For IDLE autocomplete
-self = c
+    cartdata = loadfile(args.filename)
+    seed = args.seed if args.seed is not None else random.getrandbits(64)
+    try:
+        c = CORES[args.core](cartdata, seed=seed) #bytes([0x60, 0x01, 0x61, 0x01, 0x60, 0x00, 0x61, 0x00, 0x12, 0x00]))
+        runner = c
+        if args.blocks:
+            import disasm
+            runner = BlockEngine(c)
+            runner.prewarm(disasm.cached(cartdata, args.core).blocks)
+    except CoreError as e:
+        # Such as a ROM too big for memory
+        sys.stderr.write("CHIP-8 Error: " + str(e) + "\n")
+        return 1
+    # For IDLE autocomplete
+    self = c
+    profiler = Profiler(c).start() if args.profile else None
+    # Replays bring their own flags
+    flags = None
+    if c.type in FLAG_TYPES and not args.no_flags and not args.replay:
+        flags = RomFlags(args.filename)
+        c.flags = flags.load()
 
-draw(c, win)
-clock = pygame.time.Clock()
-buzz = pygame.mixer.Sound("buzzer.wav")
-buzz_playing = False
-if c.type in ["SCHIP", "XO-CHIP"]:
-    if os.path.isfile(filename + ".flags"):
-        flags = pickle.load(open(filename + ".flags", "rb"))
-    else:
-        flags = bytearray(8)
-    c.flags = flags
-buzz.set_volume(0)
-buzz.play(-1)
-try:
-    while True:
-        for _ in range(TPF-1):
-            c.cycle(0)
-            #opcode = c.memory[c.pc] << 8 | c.memory[c.pc + 1]
-            #print("Registers: %s" % " ".join([str(i) for i in c.V]))
-            #input(f"I: {hex(c.I)}\tPC: {hex(c.pc)}\tOphex: {hex(opcode)}")
-        ret = c.cycle(clock.tick(FPS)/1000)
-        if ret == "exit":
-            raise KeyboardInterrupt()
-        if c.drawFlag:
-            c.drawFlag = False
-            draw(c, win)
-        # if buzz_playing != (c.sound_timer >= 0):
-        #     if buzz_playing:
-        #         buzz.stop()
-        #     else:
-        #         buzz.play(-1)
-        #     buzz_playing = not buzz_playing
-        buzz.set_volume(int(c.sound_timer>=1))
-        for event in pygame.event.get():
-            if event.type == 2: #Key down
-                if event.key in KEYMAP:
-                    c.keys[KEYMAP[event.key]] = 1
-            if event.type == 3: #Key up
-                if event.key in KEYMAP:
-                    c.keys[KEYMAP[event.key]] = 0
-            if event.type == 12: #Quit
-                raise KeyboardInterrupt()
-except CHIP8Error as e:
-    sys.stderr.write("CHIP-8 Error: " + str(e) + "\n")
-except KeyboardInterrupt:
-    print("Goodbye!")
-pygame.quit()
-if c.type in ["SCHIP", "XO-CHIP"]:
-    pickle.dump(c.flags, open(filename + ".flags", "wb+"))
+    try:
+        if args.replay:
+            recording = record.load(args.replay)
+            state, same = record.replay(recording, cartdata)
+            printstate(state)
+            print(f"Keys were held in {record.held(recording)} of the recorded frames")
+            print("The screen matches the recording" if same else
+                  "The screen does not match the recording")
+            return 0 if same else 1
+        elif args.serve:
+            import stream
+            printstate(stream.serve(c, runner, args.serve, args.cycles_per_frame, flags=flags))
+        elif args.headless and args.capture:
+            import capture
+            recording = capture.Capture(c, capture.writer(args.capture, args.scale), args.scale)
+            state = capture.run_frames(c, runner, args.frames, args.cycles_per_frame, recording)
+            # Raw video may be going to standard output
+            with contextlib.redirect_stdout(sys.stderr if args.capture == "-" else sys.stdout):
+                printstate(state)
+                print(f"Captured {recording.frames} different frames")
+        elif args.headless:
+            printstate(runner.run_frames(args.frames, args.cycles_per_frame))
+        else:
+            import window
+            speed = SpeedController(args.speed, args.cycles_per_frame, window.FPS, args.ips)
+            recorder = None
+            if args.record:
+                recorder = record.Recorder(c, cartdata, seed, args.blocks)
+            try:
+                window.run(c, runner, args.filename, speed, recorder, flags)
+            finally:
+                if recorder:
+                    recorder.save(args.record)
+    except CoreError as e:
+        sys.stderr.write("CHIP-8 Error: " + str(e) + "\n")
+        return 1
+    except KeyboardInterrupt:
+        print("Goodbye!")
+    finally:
+        if flags:
+            flags.update(c.flags)
+            flags.close()
+        if profiler:
+            profiler.stop()
+            print(profiler.report())
+            print(profiler.heatmap())
+            if args.profile is not True:
+                profiler.save(args.profile)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+# Per-instruction microbenchmarks
+#
+# Times each instruction handler on its own, on each core. A case is a
+# stream of the same instruction (or, for jumps and calls, one that walks
+# forward through memory) run from a known machine state. The time covers
+# fetching and decoding too, the same way Core.run does it, but no idle
+# loop skipping. Every pass starts again from the same state, which is
+# restored between passes without being timed.
+
+import argparse, statistics, sys, time
+from collections import namedtuple
+
+from cores import CORES
+
+START = 0x200 # Where the instruction stream starts
+STREAM = 64 # Instructions run per pass
+SCRATCH = 0x800 # I for instructions that write memory
+SPRITE = 0xD00 # 32 bytes of set pixels
+RETURN = 0xE00 # A lone 00EE for calls to return from
+FONT = 0x50
+
+# V0 is 3, key 3 is down and V1 is 5, so that the "taken" and "not taken"
+# skips below go the way they say
+REGISTERS = bytes([3, 5, 0x80, 0x7F, 1, 0xFF, 7, 9, 10, 11, 12, 13, 14, 15, 0x40, 0])
+KEY = 3
+
+# op is an opcode, or a function of the address it is at. Cases with
+# hires set only run on cores with the SCHIP instructions.
+Case = namedtuple("Case", "label op I hires", defaults=(SCRATCH, False))
+
+CASES = [
+    Case("00E0 clear", 0x00E0),
+    Case("00E0 clear hires", 0x00E0, hires=True),
+    Case("00C4 scroll down", 0x00C4),
+    Case("00FB scroll right", 0x00FB),
+    Case("00FC scroll left", 0x00FC),
+    Case("00FD exit", 0x00FD),
+    Case("00FE lores", 0x00FE),
+    Case("00FF hires", 0x00FF),
+    Case("2nnn/00EE call and return",
+         lambda address: 0x2000 | RETURN),
+    Case("1nnn forward", lambda address: 0x1000 | address + 2),
+    Case("1nnn to itself", lambda address: 0x1000 | address),
+    Case("3xnn taken", 0x3003),
+    Case("3xnn not taken", 0x3004),
+    Case("4xnn taken", 0x4004),
+    Case("4xnn not taken", 0x4003),
+    Case("5xy0 not taken", 0x5010),
+    Case("5xy2 V0-VF", 0x50F2),
+    Case("5xy3 V0-VF", 0x50F3),
+    Case("6xnn", 0x6A12),
+    Case("7xnn", 0x7A12),
+    Case("8xy0", 0x8A20),
+    Case("8xy1", 0x8A21),
+    Case("8xy2", 0x8A22),
+    Case("8xy3", 0x8A23),
+    Case("8xy4", 0x8A24),
+    Case("8xy5", 0x8A25),
+    Case("8xy6", 0x8A26),
+    Case("8xy7", 0x8A27),
+    Case("8xyE", 0x8A2E),
+    Case("9xy0 taken", 0x9010),
+    Case("Annn", 0xA123),
+    # Jumps to the next instruction, as V0 is 3
+    Case("Bnnn", lambda address: 0xB000 | address - 1),
+    Case("Cxnn", 0xCAFF),
+    Case("Dxy5 font digit", 0xD015, FONT),
+    Case("Dxyf 8x15", 0xD01F, SPRITE),
+    Case("Dxyf 8x15 hires", 0xD01F, SPRITE, True),
+    Case("Dxy0 16x16 hires", 0xD010, SPRITE, True),
+    Case("Ex9E taken", 0xE09E),
+    Case("ExA1 not taken", 0xE0A1),
+    Case("F000 long load",
+         lambda address: 0xF000 if (address - START) % 4 == 0 else SPRITE),
+    Case("Fx01 plane", 0xF201),
+    Case("F002 audio", 0xF002),
+    Case("Fx07", 0xFA07),
+    Case("Fx0A waiting", 0xFA0A),
+    Case("Fx15", 0xFA15),
+    Case("Fx18", 0xFA18),
+    Case("Fx1E", 0xFA1E),
+    Case("Fx29", 0xFA29),
+    Case("Fx30", 0xFA30),
+    Case("Fx33", 0xF233),
+    Case("Fx3A pitch", 0xFA3A),
+    Case("Fx55 V0", 0xF055),
+    Case("Fx55 V0-VF", 0xFF55),
+    Case("Fx65 V0", 0xF065),
+    Case("Fx65 V0-VF", 0xFF65),
+    Case("Fx75 V0-V7", 0xF775),
+    Case("Fx85 V0-V7", 0xF785),
+]
+
+Result = namedtuple("Result", "label core median stdev")
+
+def setup(variant, case):
+    # A machine with the case's instruction stream loaded, or None if the
+    # core doesn't have the instruction
+    chip = CORES[variant]()
+    if case.hires and "schip" not in chip.quirks["instructions"]:
+        return None
+    # Twice the stream, in case every other instruction gets skipped
+    for address in range(START, START + STREAM*4, 2):
+        op = case.op(address) if callable(case.op) else case.op
+        chip.memory[address:address + 2] = op.to_bytes(2, "big")
+    chip.memory[RETURN:RETURN + 2] = b"\x00\xEE"
+    chip.memory[SPRITE:SPRITE + 32] = b"\xFF" * 32
+    # Random looking pixels, so scrolls and sprites have something to move
+    chip.gfx_rows = [(row * 0x9E3779B97F4A7C15) ** 2 & ((1 << 128) - 1) for row in range(64)]
+    if chip.quirks["planes"]:
+        chip.gfx2_rows = list(chip.gfx_rows)
+    reset(chip, case, chip.gfx_rows)
+    if chip.table[case.op(START) if callable(case.op) else case.op][0].__name__ == "op_unknown":
+        return None
+    return chip
+
+def reset(chip, case, rows):
+    chip.pc = START
+    chip.I = case.I
+    chip.V[:] = REGISTERS
+    chip.stack = []
+    chip.keys[:] = bytes(16)
+    chip.keys[KEY] = 1
+    chip.keypress_tmp = set()
+    chip.hires = case.hires
+    chip.plane = 1
+    chip.gfx_rows = list(rows)
+    if chip.quirks["planes"]:
+        chip.gfx2_rows = list(rows)
+    chip.retable()
+
+def execute(chip, count):
+    # Core.run without the idle loop skipping
+    memory = chip.memory
+    for _ in range(count):
+        opcode = memory[chip.pc] << 8 | memory[chip.pc + 1]
+        handler, args = chip.table[opcode]
+        handler(chip, *args)
+        chip.pc += 2
+
+def measure(chip, case, passes):
+    # Nanoseconds per instruction over passes passes
+    rows = list(chip.gfx_rows)
+    total = 0
+    for _ in range(passes):
+        reset(chip, case, rows)
+        start = time.perf_counter_ns()
+        execute(chip, STREAM)
+        total += time.perf_counter_ns() - start
+    return total / (passes * STREAM)
+
+def bench(variant, case, passes, repeat, warmup):
+    chip = setup(variant, case)
+    if chip is None:
+        return None
+    measure(chip, case, warmup)
+    times = [measure(chip, case, passes) for _ in range(repeat)]
+    return Result(case.label, variant, statistics.median(times),
+                  statistics.stdev(times) if repeat > 1 else 0.0)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--cores", nargs="+", choices=CORES, default=list(CORES),
+                        help="Interpreters to time")
+    parser.add_argument("--only", nargs="+", default=[],
+                        help="Only run cases whose label contains one of these")
+    parser.add_argument("--passes", type=int, default=50,
+                        help=f"Passes of {STREAM} instructions per measurement")
+    parser.add_argument("--repeat", type=int, default=7,
+                        help="Measurements per case, of which the median counts")
+    parser.add_argument("--warmup", type=int, default=10,
+                        help="Untimed passes before measuring")
+    args = parser.parse_args()
+
+    results = []
+    for case in CASES:
+        if args.only and not any(word in case.label for word in args.only):
+            continue
+        for variant in args.cores:
+            result = bench(variant, case, args.passes, args.repeat, args.warmup)
+            if result:
+                results.append(result)
+
+    results.sort(key=lambda result: result.median, reverse=True)
+    print(f"{'Instruction':28} {'Core':7} {'ns/instr':>10} {'stdev':>8} {'MIPS':>7}")
+    for result in results:
+        print(f"{result.label:28} {result.core:7} {result.median:10.1f} "
+              f"{result.stdev:8.1f} {1000 / result.median:7.2f}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,770 @@
+#!/usr/bin/env python3
+# Octo assembler
+#
+# A line for line port of the bundled compiler (octo-compiler/js/compiler.js)
+# that runs in process, so nothing has to start Node. The output is the
+# same, byte for byte: labels and forward references, :alias, :const,
+# :calc, macros, loops and branches, data, :org, and the SCHIP and XO-CHIP
+# instructions, including i := long.
+#
+# The expressions in :calc and :byte { } are worked out the way JavaScript
+# would, in doubles, with the bitwise operators on 32-bit integers.
+
+import argparse, math, re, sys
+
+class OctoError(Exception):
+    def __init__(self, message, line=None):
+        super().__init__(message if line is None else f"line {line}: {message}")
+        self.message = message
+        self.line = line
+
+# Numbers, with the same forms the JS compiler reads
+BINARY = re.compile(r"[+\-]?0b[01]+$")
+HEX = re.compile(r"[+\-]?0x[0-9a-f]+$", re.I)
+DECIMAL = re.compile(r"[+\-]?[0-9]+$")
+# What JavaScript's unary + makes of any other string
+JS_NUMBER = re.compile(r"[+\-]?(Infinity|([0-9]+\.?[0-9]*|\.[0-9]+)([eE][+\-]?[0-9]+)?)$")
+JS_RADIX = re.compile(r"0([xX][0-9a-fA-F]+|[oO][0-7]+|[bB][01]+)$")
+TOKEN = re.compile(r"#[^\n]*|[^ \t\n\r\v#]+")
+
+def parse(token):
+    if BINARY.match(token):
+        value = int(token.lstrip("+-")[2:], 2)
+        return -value if token[0] == "-" else value
+    if HEX.match(token):
+        return int(token, 16)
+    if DECIMAL.match(token):
+        return int(token, 10)
+    return token
+
+def tokenize(text):
+    # [(token, start), ...], where start counts from 1
+    return [(parse(match.group()), match.start() + 1)
+            for match in TOKEN.finditer(text) if match.group()[0] != "#"]
+
+def is_number(value):
+    return not isinstance(value, str)
+
+def js_number(token):
+    # +token in JavaScript, or NaN
+    if is_number(token):
+        return token
+    if JS_NUMBER.match(token):
+        return float(token)
+    if JS_RADIX.match(token):
+        return int(token, 0)
+    return math.nan
+
+def int32(x):
+    # ToInt32: what JavaScript's bitwise operators see of a number
+    if isinstance(x, float):
+        if not math.isfinite(x):
+            return 0
+        x = int(x)
+    x &= 0xFFFFFFFF
+    return x - 0x100000000 if x & 0x80000000 else x
+
+def js_divide(x, y):
+    if y == 0:
+        if x == 0 or math.isnan(x):
+            return math.nan
+        return math.inf if (x > 0) == (math.copysign(1, y) > 0) else -math.inf
+    return x / y
+
+def js_remainder(x, y):
+    if y == 0 or math.isnan(x) or math.isnan(y) or math.isinf(x):
+        return math.nan
+    if math.isinf(y):
+        return x
+    if isinstance(x, int) and isinstance(y, int):
+        return abs(x) % abs(y) * (-1 if x < 0 else 1)
+    return math.fmod(x, y)
+
+def js_math(function):
+    # A Math function: NaN or infinity instead of an exception
+    def call(*args):
+        try:
+            return function(*args)
+        except OverflowError:
+            return math.inf
+        except ValueError:
+            if function is math.log and args[0] == 0:
+                return -math.inf
+            return math.nan
+    return call
+
+def js_round(function):
+    def call(x):
+        return x if isinstance(x, float) and not math.isfinite(x) else function(x)
+    return call
+
+def js_pow(x, y):
+    try:
+        return math.pow(x, y)
+    except OverflowError:
+        return math.inf
+    except ValueError:
+        return math.inf if x == 0 else math.nan
+
+def js_min(x, y):
+    return math.nan if math.isnan(x) or math.isnan(y) else min(x, y)
+
+def js_max(x, y):
+    return math.nan if math.isnan(x) or math.isnan(y) else max(x, y)
+
+def js_sign(x):
+    return x if math.isnan(x) or x == 0 else (1 if x > 0 else -1)
+
+UNARY = {
+    "-": lambda x, m: -x,
+    "~": lambda x, m: ~int32(x),
+    "!": lambda x, m: int(x == 0 or math.isnan(x)),
+    "sin": lambda x, m: js_math(math.sin)(x),
+    "cos": lambda x, m: js_math(math.cos)(x),
+    "tan": lambda x, m: js_math(math.tan)(x),
+    "exp": lambda x, m: js_math(math.exp)(x),
+    "log": lambda x, m: js_math(math.log)(x),
+    "abs": lambda x, m: abs(x),
+    "sqrt": lambda x, m: js_math(math.sqrt)(x),
+    "sign": lambda x, m: js_sign(x),
+    "ceil": lambda x, m: js_round(math.ceil)(x),
+    "floor": lambda x, m: js_round(math.floor)(x),
+    "@": lambda x, m: m.get(int32(x) - 0x200) or 0,
+}
+BINARY_OPS = {
+    "-": lambda x, y: x - y,
+    "+": lambda x, y: x + y,
+    "*": lambda x, y: x * y,
+    "/": js_divide,
+    "%": js_remainder,
+    "&": lambda x, y: int32(int32(x) & int32(y)),
+    "|": lambda x, y: int32(int32(x) | int32(y)),
+    "^": lambda x, y: int32(int32(x) ^ int32(y)),
+    "<<": lambda x, y: int32(int32(x) << (int32(y) & 31)),
+    ">>": lambda x, y: int32(x) >> (int32(y) & 31),
+    "pow": js_pow,
+    "min": js_min,
+    "max": js_max,
+    "<": lambda x, y: int(x < y),
+    ">": lambda x, y: int(x > y),
+    "<=": lambda x, y: int(x <= y),
+    ">=": lambda x, y: int(x >= y),
+    "==": lambda x, y: int(x == y),
+    "!=": lambda x, y: int(x != y),
+}
+
+RESERVED = {
+    ":=", "|=", "&=", "^=", "-=", "=-", "+=", ">>=", "<<=", "==", "!=", "<", ">",
+    "<=", ">=", "key", "-key", "hex", "bighex", "random", "delay", ":", ":next",
+    ":unpack", ":breakpoint", ":proto", ":alias", ":const", ":org", ";", "return",
+    "clear", "bcd", "save", "load", "buzzer", "if", "then", "begin", "else", "end",
+    "jump", "jump0", "native", "sprite", "loop", "while", "again", "scroll-down",
+    "scroll-right", "scroll-left", "lores", "hires", "loadflags", "saveflags", "i",
+    "audio", "plane", "scroll-up", ":macro", ":calc", ":byte", ":call",
+}
+
+KEYS = {
+    "OCTO_KEY_1": 0x1, "OCTO_KEY_2": 0x2, "OCTO_KEY_3": 0x3, "OCTO_KEY_4": 0xC,
+    "OCTO_KEY_Q": 0x4, "OCTO_KEY_W": 0x5, "OCTO_KEY_E": 0x6, "OCTO_KEY_R": 0xD,
+    "OCTO_KEY_A": 0x7, "OCTO_KEY_S": 0x8, "OCTO_KEY_D": 0x9, "OCTO_KEY_F": 0xE,
+    "OCTO_KEY_Z": 0xA, "OCTO_KEY_X": 0x0, "OCTO_KEY_C": 0xB, "OCTO_KEY_V": 0xF,
+}
+
+# The conditions if ... begin and while skip over, and their opposites
+NEGATED = {"==": "!=", "!=": "==", "key": "-key", "-key": "key",
+           "<": ">=", ">": "<=", ">=": "<", "<=": ">"}
+
+# vx op= vy
+ALU = {"|=": 0x1, "&=": 0x2, "^=": 0x3, "-=": 0x5, "=-": 0x7, ">>=": 0x6, "<<=": 0xE}
+# SCHIP instructions with no arguments
+SCHIP = {"scroll-right": 0xFB, "scroll-left": 0xFC, "exit": 0xFD, "lores": 0xFE, "hires": 0xFF}
+
+def text(value):
+    # A token as JavaScript would put it in a message
+    if isinstance(value, float):
+        return str(int(value)) if value.is_integer() else repr(value)
+    return str(value)
+
+class Compiler:
+    def __init__(self, source):
+        self.source = source
+        self.rom = {} # Offset from 0x200: byte. Offsets below 0 are never output.
+        self.loops = [] # [(address, token), ...]
+        self.branches = [] # [(address, token, kind), ...]
+        self.whiles = []
+        self.dict = {} # Label: address
+        self.protos = {} # Label: [addresses waiting for it]
+        self.longproto = set() # Addresses of i := long waiting for a label
+        self.aliases = {} # Name: register
+        self.constants = dict(KEYS)
+        self.macros = {} # Name: (arguments, tokens)
+        self.hasmain = True
+        self.schip = False
+        self.xo = False
+        self.breakpoints = {}
+        self.monitors = {}
+        self.hereaddr = 0x200
+        self.pos = None
+        self.current = 0
+        self.tokens = tokenize(source)
+
+    def line(self):
+        if self.pos is None:
+            return 1
+        return self.source.count("\n", 0, max(0, self.pos[1] - 1)) + 1
+
+    def error(self, message):
+        return OctoError(message, self.line())
+
+    def data(self, a):
+        offset = self.hereaddr - 0x200
+        if offset >= 0 and offset in self.rom:
+            raise self.error(f"Data overlap. Address 0x{self.hereaddr:04X} has "
+                             "already been defined.")
+        self.rom[offset] = int32(a) & 0xFF
+        self.hereaddr += 1
+
+    def end(self):
+        return self.current >= len(self.tokens)
+
+    def raw(self):
+        if self.end():
+            raise self.error("Unexpected end of program.")
+        self.pos = self.tokens[self.current]
+        self.current += 1
+        return self.pos
+
+    def next(self):
+        return self.raw()[0]
+
+    def peek(self):
+        if self.end():
+            raise self.error("Unexpected end of program.")
+        return self.tokens[self.current][0]
+
+    def here(self):
+        return self.hereaddr
+
+    def inst(self, a, b):
+        self.data(a)
+        self.data(b)
+
+    def immediate(self, op, nnn):
+        self.inst(op | ((nnn >> 8) & 0xF), nnn & 0xFF)
+
+    def fourop(self, op, x, y, n):
+        self.inst((op << 4) | x, (y << 4) | (n & 0xF))
+
+    def jump(self, addr, dest):
+        self.rom[addr - 0x200] = 0x10 | ((dest >> 8) & 0xF)
+        self.rom[addr - 0x1FF] = dest & 0xFF
+
+    def is_register(self, name=None):
+        if name is None:
+            name = self.peek()
+        if not isinstance(name, str):
+            return False
+        if name in self.aliases:
+            return True
+        name = name.upper()
+        return len(name) == 2 and name[0] == "V" and name[1] in "0123456789ABCDEF"
+
+    def register(self, name=None):
+        if name is None:
+            name = self.next()
+        if not self.is_register(name):
+            raise self.error(f"Expected register, got '{text(name)}'")
+        if name in self.aliases:
+            return self.aliases[name]
+        return "0123456789ABCDEF".index(name[1].upper())
+
+    def expect(self, token):
+        thing = self.next()
+        if thing != token:
+            raise self.error(f"Expected '{token}', got '{text(thing)}'!")
+
+    def constant_value(self):
+        number = self.next()
+        if not is_number(number):
+            if number in self.protos:
+                raise self.error("Constants cannot refer to the address of a forward declaration.")
+            elif number in self.dict:
+                number = self.dict[number]
+            elif number in self.constants:
+                number = self.constants[number]
+            else:
+                raise self.error(f"Undefined name '{number}'.")
+        return number
+
+    def check_name(self, name, kind):
+        if not isinstance(name, str):
+            raise self.error(f"The number '{text(name)}' cannot be used for a {kind}.")
+        if name in RESERVED or name.startswith("OCTO_"):
+            raise self.error(f"The name '{name}' is reserved and cannot be used for a {kind}.")
+        return name
+
+    def very_wide_value(self, no_forward=False):
+        # i := long NNNN
+        nnnn = self.next()
+        if not is_number(nnnn):
+            if nnnn in self.constants:
+                nnnn = self.constants[nnnn]
+            elif nnnn in self.dict:
+                nnnn = self.dict[nnnn]
+            elif no_forward:
+                raise self.error(f"The reference to '{nnnn}' may not be forward-declared.")
+            elif nnnn in self.protos:
+                self.protos[nnnn].append(self.here() + 2)
+                self.longproto.add(self.here() + 2)
+                nnnn = 0
+            else:
+                self.protos[self.check_name(nnnn, "label")] = [self.here() + 2]
+                self.longproto.add(self.here() + 2)
+                nnnn = 0
+        if nnnn < 0 or nnnn > 0xFFFF:
+            raise self.error(f"Value '{text(nnnn)}' cannot fit in 16 bits!")
+        return int32(nnnn) & 0xFFFF
+
+    def wide_value(self, nnn=None):
+        # Can be a forward reference: call, jump, jump0, i :=
+        if nnn is None:
+            nnn = self.next()
+        if not is_number(nnn):
+            if nnn in self.constants:
+                nnn = self.constants[nnn]
+            elif nnn in self.protos:
+                self.protos[nnn].append(self.here())
+                nnn = 0
+            elif nnn in self.dict:
+                nnn = self.dict[nnn]
+            else:
+                self.protos[self.check_name(nnn, "label")] = [self.here()]
+                nnn = 0
+        if nnn < 0 or nnn > 0xFFF:
+            raise self.error(f"Value '{text(nnn)}' cannot fit in 12 bits!")
+        return int32(nnn) & 0xFFF
+
+    def short_value(self, nn=None):
+        # vx :=, vx +=, vx ==, vx !=, random
+        if nn is None:
+            nn = self.next()
+        if not is_number(nn):
+            if nn in self.constants:
+                nn = self.constants[nn]
+            else:
+                raise self.error(f"Undefined name '{nn}'.")
+        # Negative numbers are trimmed, but positive ones too large are errors
+        if nn < -128 or nn > 255:
+            raise self.error(f"Argument '{text(nn)}' does not fit in a byte- "
+                             "must be in range [-128, 255].")
+        return int32(nn) & 0xFF
+
+    def tiny_value(self):
+        # Sprite height, :unpack's high nybble
+        n = self.next()
+        if not is_number(n):
+            if n in self.constants:
+                n = self.constants[n]
+            else:
+                raise self.error(f"Undefined name '{n}'.")
+        if n < 0 or n > 15:
+            raise self.error(f"Invalid argument '{text(n)}'; must be in range [0,15].")
+        return int32(n) & 0xF
+
+    def conditional(self, negated):
+        reg = self.register()
+        token = self.next()
+        temp = 0xF
+        if negated:
+            token = NEGATED.get(token, token)
+        if token == "==":
+            if self.is_register():
+                self.inst(0x90 | reg, self.register() << 4)
+            else:
+                self.inst(0x40 | reg, self.short_value())
+        elif token == "!=":
+            if self.is_register():
+                self.inst(0x50 | reg, self.register() << 4)
+            else:
+                self.inst(0x30 | reg, self.short_value())
+        elif token == "key":
+            self.inst(0xE0 | reg, 0xA1)
+        elif token == "-key":
+            self.inst(0xE0 | reg, 0x9E)
+        elif token in (">", "<", ">=", "<="):
+            if self.is_register():
+                self.fourop(0x8, temp, self.register(), 0x0)
+            else:
+                self.inst(0x60 | temp, self.short_value())
+            # vf -= vx or vf =- vx, then skip on vf
+            self.fourop(0x8, temp, reg, 0x5 if token in (">", "<=") else 0x7)
+            self.inst(0x4F if token in (">", "<") else 0x3F, 0)
+        else:
+            raise self.error(f"Conditional flag expected, got '{text(token)}!")
+
+    def control_token(self):
+        # The token after a condition
+        op = self.tokens[self.current + 1][0] if self.current + 1 < len(self.tokens) else None
+        index = 2 if op in ("key", "-key") else 3
+        if index + self.current >= len(self.tokens):
+            index = len(self.tokens) - self.current - 1
+        return self.tokens[index + self.current]
+
+    def iassign(self, token):
+        if token == ":=":
+            o = self.next()
+            if o == "hex":
+                self.inst(0xF0 | self.register(), 0x29)
+            elif o == "bighex":
+                self.schip = True
+                self.inst(0xF0 | self.register(), 0x30)
+            elif o == "long":
+                self.xo = True
+                addr = self.very_wide_value()
+                self.inst(0xF0, 0x00)
+                self.inst((addr >> 8) & 0xFF, addr & 0xFF)
+            else:
+                self.immediate(0xA0, self.wide_value(o))
+        elif token == "+=":
+            self.inst(0xF0 | self.register(), 0x1E)
+        else:
+            raise self.error(f"The operator '{text(token)}' cannot target the i register.")
+
+    def vassign(self, reg, token):
+        if token == ":=":
+            o = self.next()
+            if self.is_register(o):
+                self.fourop(0x8, reg, self.register(o), 0x0)
+            elif o == "random":
+                self.inst(0xC0 | reg, self.short_value())
+            elif o == "key":
+                self.inst(0xF0 | reg, 0x0A)
+            elif o == "delay":
+                self.inst(0xF0 | reg, 0x07)
+            else:
+                self.inst(0x60 | reg, self.short_value(o))
+        elif token == "+=":
+            if self.is_register():
+                self.fourop(0x8, reg, self.register(), 0x4)
+            else:
+                self.inst(0x70 | reg, self.short_value())
+        elif token in ALU:
+            self.fourop(0x8, reg, self.register(), ALU[token])
+        else:
+            raise self.error(f"Unrecognized operator '{text(token)}'.")
+
+    def resolve_label(self, offset):
+        target = self.here() + offset
+        label = self.check_name(self.next(), "label")
+        if target == 0x202 and label == "main":
+            self.hasmain = False
+            self.rom = {}
+            self.hereaddr = 0x200
+            target = self.here()
+        if label in self.dict:
+            raise self.error(f"The name '{label}' has already been defined.")
+        self.dict[label] = target
+
+        for addr in self.protos.pop(label, []):
+            rom = self.rom
+            if addr in self.longproto:
+                # i := long target
+                rom[addr - 0x200] = (target >> 8) & 0xFF
+                rom[addr - 0x1FF] = target & 0xFF
+            else:
+                if target & 0xFFF != target:
+                    raise self.error(f"Value '{target}' for label '{label}' cannot not "
+                                     "fit in 12 bits!")
+                if rom.get(addr - 0x200, 0) & 0xF0 == 0x60:
+                    # :unpack target
+                    rom[addr - 0x1FF] = (rom.get(addr - 0x1FF, 0) & 0xF0) | ((target >> 8) & 0xF)
+                    rom[addr - 0x1FD] = target & 0xFF
+                else:
+                    rom[addr - 0x200] = (rom.get(addr - 0x200, 0) & 0xF0) | ((target >> 8) & 0xF)
+                    rom[addr - 0x1FF] = target & 0xFF
+
+    def parse_terminal(self, name):
+        # NUMBER | CONSTANT | LABEL | VREGISTER | '(' expression ')'
+        x = self.peek()
+        if x == "PI":
+            self.next()
+            return math.pi
+        if x == "E":
+            self.next()
+            return math.e
+        if x == "HERE":
+            self.next()
+            return self.hereaddr
+        if self.is_register(x):
+            self.next()
+            return self.register(x)
+        if not math.isnan(js_number(x)):
+            return js_number(self.next())
+        if x in self.constants:
+            return self.constants[self.next()]
+        if x in self.dict:
+            return self.dict[self.next()]
+        if x in self.protos:
+            raise self.error(f"Cannot use forward declaration '{x}' in calculated "
+                             f"constant '{name}\".")
+        if self.next() != "(":
+            raise self.error(f"Undefined constant '{text(x)}'.")
+        value = self.parse_calc(name)
+        if self.next() != ")":
+            raise self.error(f"Expected ')' for calculated constant '{name}'.")
+        return value
+
+    def parse_calc(self, name):
+        # UNARY expression | terminal BINARY expression | terminal, all
+        # right to left with no precedence
+        if self.peek() in UNARY:
+            op = UNARY[self.next()]
+            return op(self.parse_calc(name), self.rom)
+        t = self.parse_terminal(name)
+        if not self.end() and self.peek() in BINARY_OPS:
+            op = BINARY_OPS[self.next()]
+            return op(t, self.parse_calc(name))
+        return t
+
+    def parse_calculated(self, name):
+        if self.next() != "{":
+            raise self.error(f"Expected '{{' for calculated constant '{name}'.")
+        value = self.parse_calc(name)
+        if self.next() != "}":
+            raise self.error(f"Expected '}}' for calculated constant '{name}'.")
+        return value
+
+    def instruction(self, token):
+        if token == ":":
+            self.resolve_label(0)
+        elif token == ":next":
+            self.resolve_label(1)
+        elif token == ":unpack":
+            v = self.tiny_value()
+            a = self.wide_value()
+            self.inst(0x60 | self.aliases["unpack-hi"], (v << 4) | (a >> 8))
+            self.inst(0x60 | self.aliases["unpack-lo"], a)
+        elif token == ":breakpoint":
+            self.breakpoints[self.here()] = self.next()
+        elif token == ":monitor":
+            # The name is read again as the base address
+            name = self.peek()
+            self.monitors[name] = (self.very_wide_value(True), self.very_wide_value(True))
+        elif token == ":proto":
+            self.next() # Deprecated
+        elif token == ":alias":
+            name = self.check_name(self.next(), "alias")
+            self.aliases[name] = self.register()
+        elif token == ":const":
+            name = self.check_name(self.next(), "constant")
+            if name in self.constants:
+                raise self.error(f"The name '{name}' has already been defined.")
+            self.constants[name] = self.constant_value()
+        elif token == ":macro":
+            name = self.check_name(self.next(), "macro")
+            args = []
+            while not self.end() and self.peek() != "{":
+                args.append(self.check_name(self.next(), "macro argument"))
+            if self.next() != "{":
+                raise self.error(f"Expected '{{' for definition of macro '{name}'.")
+            body = []
+            depth = 1
+            while not self.end():
+                if self.peek() == "{":
+                    depth += 1
+                if self.peek() == "}":
+                    depth -= 1
+                if depth == 0:
+                    break
+                body.append(self.raw())
+            if self.next() != "}":
+                raise self.error(f"Expected '}}' for definition of macro '{name}'.")
+            self.macros[name] = (args, body)
+        elif isinstance(token, str) and token in self.macros:
+            args, body = self.macros[token]
+            bindings = {}
+            for arg in args:
+                if self.end():
+                    raise self.error(f"Not enough arguments for expansion of macro '{token}'")
+                bindings[arg] = self.raw()
+            self.tokens[self.current:self.current] = [
+                bindings.get(chunk[0], chunk) if isinstance(chunk[0], str) else chunk
+                for chunk in body]
+        elif token == ":calc":
+            name = self.check_name(self.next(), "calculated constant")
+            self.constants[name] = self.parse_calculated(name)
+        elif token == ":byte":
+            self.data(self.parse_calculated("ANONYMOUS") if self.peek() == "{"
+                      else self.short_value())
+        elif token == ":org":
+            addr = (self.parse_calculated("ANONYMOUS") if self.peek() == "{"
+                    else self.constant_value())
+            self.hereaddr = 0xFFFF & int32(addr)
+        elif token in (";", "return"):
+            self.inst(0x00, 0xEE)
+        elif token == "clear":
+            self.inst(0x00, 0xE0)
+        elif token == "bcd":
+            self.inst(0xF0 | self.register(), 0x33)
+        elif token in ("save", "load"):
+            reg = self.register()
+            if not self.end() and self.peek() == "-":
+                self.expect("-")
+                self.xo = True
+                self.inst(0x50 | reg, (self.register() << 4) | (0x02 if token == "save" else 0x03))
+            else:
+                self.inst(0xF0 | reg, 0x55 if token == "save" else 0x65)
+        elif token == "delay":
+            self.expect(":=")
+            self.inst(0xF0 | self.register(), 0x15)
+        elif token == "buzzer":
+            self.expect(":=")
+            self.inst(0xF0 | self.register(), 0x18)
+        elif token == "if":
+            control = self.control_token()
+            if control[0] == "then":
+                self.conditional(False)
+                self.expect("then")
+            elif control[0] == "begin":
+                self.conditional(True)
+                self.expect("begin")
+                self.branches.append((self.here(), self.pos, "begin"))
+                self.inst(0x00, 0x00)
+            else:
+                self.pos = control
+                raise self.error("Expected 'then' or 'begin'.")
+        elif token == "else":
+            if not self.branches:
+                raise self.error("This 'else' does not have a matching 'begin'.")
+            self.jump(self.branches.pop()[0], self.here() + 2)
+            self.branches.append((self.here(), self.pos, "else"))
+            self.inst(0x00, 0x00)
+        elif token == "end":
+            if not self.branches:
+                raise self.error("This 'end' does not have a matching 'begin'.")
+            self.jump(self.branches.pop()[0], self.here())
+        elif token == "jump0":
+            self.immediate(0xB0, self.wide_value())
+        elif token == "jump":
+            self.immediate(0x10, self.wide_value())
+        elif token == "native":
+            self.immediate(0x00, self.wide_value())
+        elif token == "sprite":
+            r1 = self.register()
+            r2 = self.register()
+            size = self.tiny_value()
+            if size == 0:
+                self.schip = True
+            self.inst(0xD0 | r1, (r2 << 4) | size)
+        elif token == "loop":
+            self.loops.append((self.here(), self.pos))
+            self.whiles.append(None)
+        elif token == "while":
+            if not self.loops:
+                raise self.error("This 'while' is not within a loop.")
+            self.conditional(True)
+            self.whiles.append(self.here())
+            self.immediate(0x10, 0)
+        elif token == "again":
+            if not self.loops:
+                raise self.error("This 'again' does not have a matching 'loop'.")
+            self.immediate(0x10, self.loops.pop()[0])
+            while self.whiles[-1] is not None:
+                self.jump(self.whiles.pop(), self.here())
+            self.whiles.pop()
+        elif token == "plane":
+            plane = self.tiny_value()
+            if plane > 3:
+                raise self.error("the plane bitmask must be [0, 3].")
+            self.xo = True
+            self.inst(0xF0 | plane, 0x01)
+        elif token == "audio":
+            self.xo = True
+            self.inst(0xF0, 0x02)
+        elif token == "scroll-down":
+            self.schip = True
+            self.inst(0x00, 0xC0 | self.tiny_value())
+        elif token == "scroll-up":
+            self.xo = True
+            self.inst(0x00, 0xD0 | self.tiny_value())
+        elif token in SCHIP:
+            self.schip = True
+            self.inst(0x00, SCHIP[token])
+        elif token in ("saveflags", "loadflags"):
+            flags = self.register()
+            if flags > 7:
+                raise self.error(f"{token} argument must be v[0,7].")
+            self.schip = True
+            self.inst(0xF0 | flags, 0x75 if token == "saveflags" else 0x85)
+        elif token == "i":
+            self.iassign(self.next())
+        elif self.is_register(token):
+            self.vassign(self.register(token), self.next())
+        elif token == ":call":
+            addr = (self.parse_calculated("ANONYMOUS") if self.peek() == "{"
+                    else self.wide_value(self.next()))
+            self.immediate(0x20, 0xFFF & int32(addr))
+        else:
+            self.immediate(0x20, self.wide_value(token))
+
+    def go(self):
+        self.aliases["unpack-hi"] = 0x0
+        self.aliases["unpack-lo"] = 0x1
+
+        self.inst(0, 0) # Reserve a jump slot
+        while not self.end():
+            if is_number(self.peek()):
+                nn = self.next()
+                if nn < -128 or nn > 255:
+                    raise self.error(f"Literal value '{nn}' does not fit in a byte- "
+                                     "must be in range [-128, 255].")
+                self.data(nn)
+            else:
+                self.instruction(self.next())
+        if self.hasmain:
+            # Resolve the main branch
+            self.jump(0x200, self.wide_value("main"))
+        if self.protos:
+            raise self.error("Undefined names: " + ",".join(self.protos))
+        if self.loops:
+            self.pos = self.loops[0][1]
+            raise self.error("This 'loop' does not have a matching 'again'.")
+        if self.branches:
+            self.pos = self.branches[0][1]
+            raise self.error(f"This '{self.branches[0][2]}' does not have a matching 'end'.")
+        size = max((offset + 1 for offset in self.rom if offset >= 0), default=0)
+        rom = bytearray(size)
+        for offset, value in self.rom.items():
+            if offset >= 0:
+                rom[offset] = value
+        return bytes(rom)
+
+def assemble(source):
+    # The ROM for some Octo source, or raises OctoError
+    compiler = Compiler(source)
+    try:
+        return compiler.go()
+    except RecursionError:
+        raise compiler.error("Expression too deeply nested.")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("source", help="Octo .8o file")
+    parser.add_argument("output", nargs="?", help="ROM to write, or standard output")
+    args = parser.parse_args()
+    with open(args.source, encoding="utf-8-sig") as f:
+        source = f.read()
+    try:
+        rom = assemble(source)
+    except OctoError as e:
+        print(e, file=sys.stderr)
+        return 1
+    if args.output:
+        with open(args.output, "wb") as f:
+            f.write(rom)
+    else:
+        sys.stdout.buffer.write(rom)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,10 @@
+# Screen colours, by pixel value: bit 0 from the first plane, bit 1 from
+# the second. Kept apart from the window so headless tools can use them
+# without pygame.
+
+OFF_COLOR =     ( 20, 50, 80)
+FG1_COLOR =     (100,255,100)
+FG2_COLOR =     (255,100,100)
+BLENDED_COLOR = (255,255,100)
+
+PALETTE = [OFF_COLOR, FG1_COLOR, FG2_COLOR, BLENDED_COLOR]
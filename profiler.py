@@ -0,0 +1,134 @@
+# Instruction and address profiler
+#
+# Profiler(chip).start() gives the machine an instrumented copy of run(),
+# which counts every instruction by handler and by address and times each
+# handler. stop() takes it away again, so a machine that isn't being
+# profiled runs exactly the code it always does. Instructions skipped as
+# idle loops aren't run, so they are only counted as a total. The block
+# engine doesn't go through run(), so only the interpreter can be profiled.
+
+import json, math, time
+from itertools import islice
+from operator import length_hint
+
+SHADES = " .:-=+*#%@" # Heat map, from never run to the hottest address
+
+class Profiler:
+    def __init__(self, chip):
+        self.chip = chip
+        self.reset()
+
+    def reset(self):
+        self.calls = {} # handler: [count, nanoseconds]
+        self.pcs = [0] * (len(self.chip.memory) + 2) # Instructions run at each address
+        self.skipped = 0
+
+    def start(self):
+        self.chip.run = self.run
+        return self
+
+    def stop(self):
+        self.chip.__dict__.pop("run", None)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def run(self, count, noexit=False):
+        # Core.run, counting and timing as it goes
+        chip = self.chip
+        memory = chip.memory
+        calls = self.calls
+        pcs = self.pcs
+        clock = time.perf_counter_ns
+        skipped = chip.skipped
+        chip.idle_watch = None
+        steps = iter(range(count))
+        try:
+            for _ in steps:
+                pc = chip.pc
+                opcode = memory[pc] << 8 | memory[pc + 1]
+                handler, args = chip.table[opcode]
+                start = clock()
+                signal = handler(chip, *args)
+                elapsed = clock() - start
+                pcs[pc] += 1
+                entry = calls.get(handler)
+                if entry is None:
+                    entry = calls[handler] = [0, 0]
+                entry[0] += 1
+                entry[1] += elapsed
+                if signal:
+                    if signal == "exit":
+                        if not noexit:
+                            return "exit"
+                    else:
+                        skip = chip.idle(signal, length_hint(steps))
+                        next(islice(steps, skip, skip), None)
+                chip.pc += 2
+        finally:
+            self.skipped += chip.skipped - skipped
+
+    def instructions(self):
+        # {pattern: (count, nanoseconds)}. The handlers for each resolution,
+        # plane and quirk are separate functions, so merge them by name.
+        merged = {}
+        for handler, (count, ns) in self.calls.items():
+            name = handler.__name__[3:]
+            total = merged.get(name, (0, 0))
+            merged[name] = (total[0] + count, total[1] + ns)
+        return merged
+
+    def hot(self, limit=10):
+        # [(address, count), ...], most run first
+        ranked = sorted((count, -pc) for pc, count in enumerate(self.pcs) if count)
+        return [(-pc, count) for count, pc in reversed(ranked[-limit:])]
+
+    def report(self, limit=10):
+        instructions = self.instructions()
+        total_count = sum(count for count, ns in instructions.values()) or 1
+        total_ns = sum(ns for count, ns in instructions.values()) or 1
+        lines = [f"{'Instruction':12} {'Count':>10} {'%':>6} {'Total ms':>10} "
+                 f"{'ns each':>8} {'% time':>7}"]
+        for name, (count, ns) in sorted(instructions.items(), key=lambda item: -item[1][1]):
+            lines.append(f"{name:12} {count:10} {100 * count / total_count:6.2f} "
+                         f"{ns / 1e6:10.3f} {ns / count:8.0f} {100 * ns / total_ns:7.2f}")
+        lines.append(f"Idle instructions skipped: {self.skipped}")
+        lines.append("")
+        lines.append(f"{'Address':8} {'Opcode':6} {'Count':>10}")
+        memory = self.chip.memory
+        for pc, count in self.hot(limit):
+            opcode = memory[pc] << 8 | memory[pc + 1]
+            lines.append(f"{pc:#06x}   {opcode:04X}   {count:10}")
+        return "\n".join(lines)
+
+    def heatmap(self, width=64):
+        # One character per 2 bytes of memory from the lowest address run to
+        # the highest, on a log scale up to the hottest one, width bytes a line
+        used = [pc for pc, count in enumerate(self.pcs) if count]
+        if not used:
+            return ""
+        start = used[0] - used[0] % width
+        end = used[-1] + 2
+        peak = math.log(max(self.pcs) + 1)
+        lines = []
+        for row in range(start, end, width):
+            line = ""
+            for pc in range(row, min(row + width, end), 2):
+                count = self.pcs[pc] + self.pcs[pc + 1]
+                level = math.ceil(math.log(count + 1) / peak * (len(SHADES) - 1)) if count else 0
+                line += SHADES[min(level, len(SHADES) - 1)]
+            lines.append(f"{row:#06x} |{line}")
+        return "\n".join(lines)
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump({
+                "type": self.chip.type,
+                "instructions": {name: {"count": count, "ns": ns}
+                                 for name, (count, ns) in self.instructions().items()},
+                "addresses": {f"{pc:#06x}": count for pc, count in enumerate(self.pcs) if count},
+                "skipped": self.skipped,
+            }, f, indent=1)
@@ -0,0 +1,109 @@
+# Input recording and replay
+#
+# A recording holds everything a run depends on besides the ROM: the RNG
+# seed, the flags it started with and whether it ran through the block
+# engine, and then for every frame the keys held, the instructions run and
+# the timer ticks after them. Runs of identical frames are stored once with
+# a count. replay() drives a core through the same frames headlessly, as
+# fast as it goes, and ends with the same framebuffer.
+
+import hashlib, struct, zlib
+from collections import namedtuple
+
+from core import CoreError
+from blocks import BlockEngine
+from snapshot import TYPES
+
+MAGIC = b"CHIPPYREC"
+VERSION = 1
+
+# Type length, seed, ROM SHA-1, block engine, flags
+HEADER = struct.Struct(">BQ20sB8s")
+# Frames in the run, instructions per frame, timer ticks per frame, keys
+FRAMES = struct.Struct(">IIIH")
+
+Recording = namedtuple("Recording", "type seed rom blocks flags frames screen")
+
+class RecordError(CoreError):
+    pass
+
+def screen_hash(chip):
+    digest = hashlib.sha1(bytes(chip.gfx))
+    if chip.quirks["planes"]:
+        digest.update(chip.gfx2)
+    return digest.digest()
+
+class Recorder:
+    def __init__(self, chip, cartdata, seed, blocks):
+        self.chip = chip
+        self.header = (chip.type, seed, hashlib.sha1(cartdata).digest(), blocks)
+        self.flags = None # As they were when the first frame started
+        self.frames = [] # [keys, instructions, ticks]
+
+    def frame(self, keys, count):
+        # A frame of count instructions, run with keys held down
+        if self.flags is None:
+            self.flags = bytes(self.chip.flags)
+        mask = sum(1 << key for key in range(16) if keys[key])
+        self.frames.append([mask, count, 0])
+
+    def tick(self, ticks):
+        # Timer ticks after the last frame
+        if self.frames:
+            self.frames[-1][2] += ticks
+
+    def save(self, path):
+        kind, seed, rom, blocks = self.header
+        flags = self.flags or bytes(self.chip.flags)
+        runs = []
+        for keys, count, ticks in self.frames:
+            if runs and runs[-1][1:] == [count, ticks, keys]:
+                runs[-1][0] += 1
+            else:
+                runs.append([1, count, ticks, keys])
+        body = b"".join(FRAMES.pack(*run) for run in runs) + screen_hash(self.chip)
+        with open(path, "wb") as f:
+            f.write(MAGIC + bytes([VERSION]) + HEADER.pack(len(kind), seed, rom, blocks, flags))
+            f.write(kind.encode() + zlib.compress(body))
+
+def load(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    if data[:len(MAGIC)] != MAGIC:
+        raise RecordError("Not a Chippy recording")
+    if data[len(MAGIC)] != VERSION:
+        raise RecordError(f"Unsupported recording version: {data[len(MAGIC)]}")
+    offset = len(MAGIC) + 1
+    length, seed, rom, blocks, flags = HEADER.unpack_from(data, offset)
+    offset += HEADER.size
+    kind = data[offset:offset + length].decode()
+    body = zlib.decompress(data[offset + length:])
+    frames = [FRAMES.unpack_from(body, i) for i in range(0, len(body) - 20, FRAMES.size)]
+    return Recording(kind, seed, rom, bool(blocks), flags, frames, body[-20:])
+
+def held(recording):
+    # Frames recorded with any key held down
+    return sum(repeat for repeat, _, _, keys in recording.frames if keys)
+
+def replay(recording, cartdata):
+    # Run a recording on its ROM, and return the final state and whether the
+    # screen came out the same as when it was recorded
+    if hashlib.sha1(cartdata).digest() != recording.rom:
+        raise RecordError("The recording was made with a different ROM")
+    chip = TYPES[recording.type](cartdata, seed=recording.seed)
+    chip.flags = bytearray(recording.flags)
+    runner = BlockEngine(chip) if recording.blocks else chip
+    frames = 0
+    exited = False
+    for repeat, count, ticks, keys in recording.frames:
+        for key in range(16):
+            chip.keys[key] = keys >> key & 1
+        for _ in range(repeat):
+            if runner.run(count) == "exit":
+                exited = True
+                break
+            chip.tick_timers(ticks)
+            frames += 1
+        if exited:
+            break
+    return chip.state(frames, exited), screen_hash(chip) == recording.screen
@@ -0,0 +1,208 @@
+# Machine snapshots and rewind
+#
+# encode() turns the whole state of a core into one flat bytes object, and
+# decode() puts it back. Two encodings of the same core are the same size,
+# so consecutive frames can be stored as the XOR between them, which is
+# mostly zeros and cheap to run-length encode. save() and restore() wrap an
+# encoding in a small versioned header for storing on disk. restore() still
+# reads snapshots in the older version 1 and 2 layouts.
+
+import re, struct, zlib
+from collections import deque
+
+from core import CoreError
+from chip import CHIP8
+from SChip import SCHIP
+from XOChip import XOCHIP
+
+MAGIC = b"CHIPPY"
+VERSION = 3
+TYPES = {"CHIP8": CHIP8, "SCHIP": SCHIP, "XO-CHIP": XOCHIP}
+
+# I, pc, delay timer, sound timer, hires, plane, drawFlag, stack depth,
+# stack, V, keys, keys held through Fx0A, flags, audio pattern, pitch,
+# memory size. The RNG state, memory and framebuffer rows follow.
+REGISTERS = struct.Struct(">IIHHBBBB16I16s16sH8s16sBI")
+# The Mersenne Twister state of Cxnn's random numbers
+RNG = struct.Struct(">625I")
+# Older layouts still read by restore(): version 1 had no pitch and no RNG
+# state, version 2 added the RNG state but still no pitch
+OLD_REGISTERS = struct.Struct(">IIHHBBBB16I16s16sH8s16sI")
+LAYOUTS = {1: (OLD_REGISTERS, False), 2: (OLD_REGISTERS, True), 3: (REGISTERS, True)}
+# One delta segment: bytes of zeros skipped, then bytes of XOR data
+SEGMENT = struct.Struct(">II")
+# Runs of changed bytes, allowing short gaps so segments don't get too small
+CHANGES = re.compile(rb"[^\x00](?:\x00{0,7}[^\x00])*")
+
+class SnapshotError(CoreError):
+    pass
+
+def encode(chip):
+    stack = list(chip.stack) + [0] * (16 - len(chip.stack))
+    held = sum(1 << key for key in chip.keypress_tmp)
+    parts = [
+        REGISTERS.pack(
+            chip.I, chip.pc, chip.delay_timer, chip.sound_timer, chip.hires,
+            chip.plane, chip.drawFlag, len(chip.stack), *stack, bytes(chip.V),
+            bytes(chip.keys), held, bytes(chip.flags), bytes(chip.audio),
+            chip.pitch, len(chip.memory),
+        ),
+        RNG.pack(*chip.rng.getstate()[1]),
+        bytes(chip.memory),
+    ]
+    for rows in [chip.gfx_rows] + ([chip.gfx2_rows] if chip.quirks["planes"] else []):
+        parts += [row.to_bytes(16, "big") for row in rows]
+    return b"".join(parts)
+
+def decode(chip, data, version=VERSION):
+    registers, rng = LAYOUTS[version]
+    fields = registers.unpack_from(data)
+    (chip.I, chip.pc, chip.delay_timer, chip.sound_timer, hires, chip.plane,
+     draw, depth) = fields[:8]
+    chip.hires, chip.drawFlag = bool(hires), bool(draw)
+    chip.stack = list(fields[8:8 + depth])
+    if registers is OLD_REGISTERS:
+        V, keys, held, flags, audio, size = fields[24:]
+        chip.pitch = 64
+    else:
+        V, keys, held, flags, audio, chip.pitch, size = fields[24:]
+    chip.V[:] = V
+    chip.keys[:] = keys
+    chip.keypress_tmp = {key for key in range(16) if held >> key & 1}
+    chip.flags = bytearray(flags)
+    chip.audio = audio
+    offset = registers.size
+    if rng:
+        chip.rng.setstate((3, RNG.unpack_from(data, offset), None))
+        offset += RNG.size
+    chip.memory[:] = data[offset:offset + size]
+    offset += size
+    planes = ["gfx_rows", "gfx2_rows"] if chip.quirks["planes"] else ["gfx_rows"]
+    count = (len(data) - offset) // 16 // len(planes)
+    for name in planes:
+        setattr(chip, name, [int.from_bytes(data[i:i + 16], "big")
+                             for i in range(offset, offset + count*16, 16)])
+        offset += count*16
+    chip.idle_watch = None
+    chip.retable()
+
+def save(chip):
+    kind = chip.type.encode()
+    return MAGIC + bytes([VERSION, len(kind)]) + kind + zlib.compress(encode(chip))
+
+def restore(chip, snapshot):
+    # Load a snapshot from save() into chip, which must be the same variant
+    header = len(MAGIC) + 2
+    if snapshot[:len(MAGIC)] != MAGIC:
+        raise SnapshotError("Not a Chippy snapshot")
+    version, length = snapshot[len(MAGIC)], snapshot[len(MAGIC) + 1]
+    if version not in LAYOUTS:
+        raise SnapshotError(f"Unsupported snapshot version: {version}")
+    kind = snapshot[header:header + length].decode()
+    if kind != chip.type:
+        raise SnapshotError(f"Snapshot is of a {kind}, not a {chip.type}")
+    decode(chip, zlib.decompress(snapshot[header + length:]), version)
+
+def load(snapshot):
+    # A new machine from a snapshot from save()
+    header = len(MAGIC) + 2
+    kind = snapshot[header:header + snapshot[len(MAGIC) + 1]].decode()
+    if kind not in TYPES:
+        raise SnapshotError(f"Unknown machine type: {kind}")
+    chip = TYPES[kind]()
+    restore(chip, snapshot)
+    return chip
+
+def diff(old, new):
+    # Run-length encoded XOR of two encodings of the same size
+    xor = (int.from_bytes(old, "big") ^ int.from_bytes(new, "big")).to_bytes(len(new), "big")
+    parts = []
+    end = 0
+    for change in CHANGES.finditer(xor):
+        parts.append(SEGMENT.pack(change.start() - end, change.end() - change.start()))
+        parts.append(change.group())
+        end = change.end()
+    return b"".join(parts)
+
+def patch(data, delta):
+    # Apply a diff() to a bytearray, in place. XOR works both ways, so this
+    # also undoes it.
+    offset = 0
+    i = 0
+    while i < len(delta):
+        skip, length = SEGMENT.unpack_from(delta, i)
+        i += SEGMENT.size
+        offset += skip
+        segment = delta[i:i + length]
+        data[offset:offset + length] = (
+            int.from_bytes(data[offset:offset + length], "big") ^ int.from_bytes(segment, "big")
+        ).to_bytes(length, "big")
+        offset += length
+        i += length
+
+class Rewind:
+    # The last frames of a machine, newest last, in at most about cap bytes.
+    # Every interval frames is a compressed keyframe, and the frames in
+    # between are diffs against the frame before, so restoring any frame
+    # takes at most interval patches.
+    def __init__(self, cap=16 << 20, interval=60):
+        self.cap = cap
+        self.interval = interval
+        self.frames = deque() # (keyframe, data)
+        self.size = 0
+        self.keyframes = 0
+        self.last = None # Encoding of the newest frame
+        self.since_key = 0
+
+    def __len__(self):
+        return len(self.frames)
+
+    def push(self, chip):
+        # Record the current state as the newest frame
+        current = encode(chip)
+        if (self.last is None or len(self.last) != len(current)
+                or self.since_key >= self.interval - 1):
+            entry = (True, zlib.compress(current, 1))
+            self.keyframes += 1
+            self.since_key = 0
+        else:
+            entry = (False, diff(self.last, current))
+            self.since_key += 1
+        self.frames.append(entry)
+        self.size += len(entry[1])
+        self.last = current
+        # Drop the oldest keyframe and its diffs until under the cap, but
+        # always keep the newest ones
+        while self.size > self.cap and self.keyframes > 1:
+            self.size -= len(self.frames.popleft()[1])
+            self.keyframes -= 1
+            while not self.frames[0][0]:
+                self.size -= len(self.frames.popleft()[1])
+
+    def frame(self, back=0):
+        # Encoding of the frame back frames before the newest
+        index = len(self.frames) - 1 - back
+        if not 0 <= index < len(self.frames):
+            raise SnapshotError(f"Only {len(self.frames)} frames to rewind through")
+        start = index
+        while not self.frames[start][0]:
+            start -= 1
+        data = bytearray(zlib.decompress(self.frames[start][1]))
+        for i in range(start + 1, index + 1):
+            patch(data, self.frames[i][1])
+        return bytes(data)
+
+    def rewind(self, chip, frames=1):
+        # Put chip back to frames before the newest, and forget the newer ones
+        data = self.frame(frames)
+        for _ in range(frames):
+            keyframe, dropped = self.frames.pop()
+            self.size -= len(dropped)
+            self.keyframes -= keyframe
+        decode(chip, data)
+        self.last = data
+        self.since_key = 0
+        for keyframe, _ in reversed(self.frames):
+            if keyframe:
+                break
+            self.since_key += 1
@@ -0,0 +1,89 @@
+# Emulation speed control
+#
+# Decides how many instructions to run each frame, in one of three modes:
+#
+#   fixed: a fixed number of instructions per second, throttled to the
+#          frame rate
+#   auto:  the most instructions per frame that still fit in the frame
+#          budget, measured from how fast the host actually runs
+#   turbo: as fast as possible, without throttling. The timers then tick
+#          once per emulated frame instead of following the wall clock.
+
+import time
+
+MODES = ("fixed", "auto", "turbo")
+HEADROOM = 0.8 # Part of the frame budget auto mode lets emulation use
+SMOOTHING = 0.1 # Weight of the newest frame in auto mode's estimates
+
+class SpeedController:
+    def __init__(self, mode, tpf, fps, ips=None):
+        self.mode = mode
+        self.fps = fps
+        self.tpf = tpf
+        self.ips = ips or tpf * fps # Target for fixed mode
+        self.carry = 0.0 # Fractional instructions left over in fixed mode
+        # Auto mode's estimates of host speed and per-frame overhead
+        self.host_ips = None
+        self.overhead = 0.0
+        # Achieved speed, measured over about a second
+        self.window_start = time.perf_counter()
+        self.window_instructions = 0
+        self.achieved = 0.0
+
+    @property
+    def throttled(self):
+        return self.mode != "turbo"
+
+    @property
+    def target(self):
+        # Instructions per second being aimed for, or None in turbo mode
+        if self.mode == "fixed":
+            return self.ips
+        if self.mode == "auto":
+            return self.tpf * self.fps
+        return None
+
+    def next_frame(self):
+        # Instructions to run this frame
+        if self.mode == "fixed":
+            self.carry += self.ips / self.fps
+            count = int(self.carry)
+            self.carry -= count
+            return count
+        return self.tpf
+
+    def frame_done(self, instructions, emulation_time, frame_time, skipped=0):
+        # Record a frame: the instructions run, the time they took, the time
+        # the whole frame took before any throttling, and how many of the
+        # instructions idle detection skipped. Skipped instructions take no
+        # time, so auto mode only calibrates on the ones executed, and not at
+        # all on frames that were mostly skipped, or waiting on Fx0A would
+        # make the host look faster and faster.
+        executed = instructions - skipped
+        if self.mode == "auto" and executed > skipped and emulation_time > 0:
+            host_ips = executed / emulation_time
+            overhead = max(0.0, frame_time - emulation_time)
+            if self.host_ips is None:
+                self.host_ips, self.overhead = host_ips, overhead
+            else:
+                self.host_ips += (host_ips - self.host_ips) * SMOOTHING
+                self.overhead += (overhead - self.overhead) * SMOOTHING
+            budget = HEADROOM / self.fps - self.overhead
+            # Grow at most twice as fast each frame, so one quick frame
+            # can't blow the next one's budget
+            self.tpf = max(1, min(int(budget * self.host_ips), self.tpf * 2))
+
+        self.window_instructions += instructions
+        now = time.perf_counter()
+        if now - self.window_start >= 1:
+            self.achieved = self.window_instructions / (now - self.window_start)
+            self.window_start = now
+            self.window_instructions = 0
+            return True # A new measurement is ready
+        return False
+
+    def report(self):
+        target = self.target
+        if target is None:
+            return f"{self.mode}: {self.achieved:.0f} IPS"
+        return f"{self.mode}: {self.achieved:.0f}/{target:.0f} IPS"
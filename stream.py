@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+# Framebuffer streaming
+#
+# Server(chip, address) lets viewers on a UNIX or TCP socket watch a
+# machine and hold down its keys, without pygame. The screen is sent as
+# its bit planes, 8 pixels a byte, and each frame only as the XOR against
+# the frame before, run-length encoded, so an unchanged screen costs
+# nothing and a moving sprite a few bytes.
+#
+# The server never blocks: poll() and publish() are called once a frame
+# and only do what the sockets take at once. Frames wait in a backlog for
+# each viewer, and if it grows past MAX_BACKLOG the viewer is skipped
+# ahead, dropping the frames it missed, and sent a whole frame once it has
+# caught up.
+#
+# Messages from the server are the length of the rest, then a FRAME header:
+# b"K" to start from a blank screen or b"D" to change the last one, the
+# frame number, the width, the height and the number of planes. Runs
+# follow, each a RUN header of the bytes to skip and the bytes to XOR,
+# then those bytes. Viewers send KEYS messages, b"k" and a mask of the
+# keys they hold down. A key is down while any viewer holds it.
+
+import argparse, os, re, selectors, socket, stat, struct, sys, time
+
+FPS = 60
+MAX_BACKLOG = 256 * 1024 # Bytes queued for a viewer before it is skipped ahead
+LENGTH = struct.Struct(">I")
+FRAME = struct.Struct(">cIBBB")
+RUN = struct.Struct(">HH")
+KEYS = struct.Struct(">cH")
+# Changed bytes, and gaps too short to be worth a run of their own
+CHANGED = re.compile(rb"[^\x00]+(?:\x00{1,%d}[^\x00]+)*" % RUN.size, re.S)
+
+def parse_address(address):
+    # (family, address) for "unix:PATH", a path with a slash, "HOST:PORT" or ":PORT"
+    if address.startswith("unix:"):
+        return socket.AF_UNIX, address[5:]
+    if "/" in address:
+        return socket.AF_UNIX, address
+    host, _, port = address.rpartition(":")
+    if not port.isdigit():
+        raise ValueError(f"Not a socket address: {address}")
+    return socket.AF_INET, (host or "127.0.0.1", int(port))
+
+def screen(chip):
+    # ((width, height, planes), bit planes packed 8 pixels a byte)
+    width, height = (128, 64) if chip.hires else (64, 32)
+    size = width * height // 8
+    planes = [chip.gfx_rows] + ([chip.gfx2_rows] if chip.quirks["planes"] else [])
+    data = b"".join(b"".join(row.to_bytes(16, "big") for row in rows)[:size] for rows in planes)
+    return (width, height, len(planes)), data
+
+def encode(kind, frame, shape, old, new):
+    # A message turning old into new
+    changes = (int.from_bytes(old, "big") ^ int.from_bytes(new, "big")).to_bytes(len(new), "big")
+    parts = [b"", FRAME.pack(kind, frame, *shape)]
+    position = 0
+    for match in CHANGED.finditer(changes):
+        parts.append(RUN.pack(match.start() - position, match.end() - match.start()))
+        parts.append(match.group())
+        position = match.end()
+    parts[0] = LENGTH.pack(sum(map(len, parts)))
+    return b"".join(parts)
+
+def decode(message, data):
+    # (frame, shape, screen) after applying message to the screen data
+    kind, frame, *shape = FRAME.unpack_from(message)
+    width, height, planes = shape
+    size = width * height // 8 * planes
+    screen = bytearray(size) if kind == b"K" or len(data) != size else bytearray(data)
+    position = FRAME.size
+    offset = 0
+    while position < len(message):
+        skip, count = RUN.unpack_from(message, position)
+        position += RUN.size
+        offset += skip
+        changes = int.from_bytes(message[position:position + count], "big")
+        current = int.from_bytes(screen[offset:offset + count], "big")
+        screen[offset:offset + count] = (current ^ changes).to_bytes(count, "big")
+        position += count
+        offset += count
+    return frame, tuple(shape), bytes(screen)
+
+class Viewer:
+    # The server's end of one viewer's connection
+    def __init__(self, sock):
+        self.sock = sock
+        self.backlog = [] # Messages not sent yet, the first maybe partly
+        self.sent = 0 # Bytes of the first message already sent
+        self.queued = 0
+        self.inbox = b""
+        self.keys = 0
+        self.stale = True # Needs a whole frame before any changes
+
+    def queue(self, message):
+        self.backlog.append(message)
+        self.queued += len(message)
+        if self.queued > MAX_BACKLOG:
+            # Skip ahead, but finish the message that is partly sent
+            self.backlog[1:] = []
+            self.queued = len(self.backlog[0])
+            self.stale = True
+
+    def flush(self):
+        # Send what the socket takes without waiting
+        while self.backlog:
+            message = self.backlog[0]
+            try:
+                sent = self.sock.send(memoryview(message)[self.sent:])
+            except (BlockingIOError, InterruptedError):
+                return
+            self.sent += sent
+            if self.sent < len(message):
+                return
+            self.backlog.pop(0)
+            self.queued -= len(message)
+            self.sent = 0
+
+class Server:
+    def __init__(self, chip, address):
+        self.chip = chip
+        self.family, self.address = parse_address(address)
+        if self.family == socket.AF_UNIX:
+            try:
+                if stat.S_ISSOCK(os.stat(self.address).st_mode):
+                    os.unlink(self.address) # Left over from an earlier server
+            except FileNotFoundError:
+                pass
+        self.listener = socket.socket(self.family, socket.SOCK_STREAM)
+        if self.family == socket.AF_INET:
+            self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind(self.address)
+        self.listener.listen()
+        self.listener.setblocking(False)
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.listener, selectors.EVENT_READ)
+        self.viewers = {} # socket: Viewer
+        self.frame = 0
+        self.shape, self.screen = screen(chip)
+
+    def publish(self):
+        # Send the screen to every viewer, if it changed. Call when the
+        # machine has drawn.
+        shape, data = screen(self.chip)
+        if shape == self.shape and data == self.screen:
+            return
+        self.frame += 1
+        message = None
+        if shape == self.shape:
+            message = encode(b"D", self.frame, shape, self.screen, data)
+        self.shape, self.screen = shape, data
+        for viewer in self.viewers.values():
+            if message is None:
+                viewer.stale = True
+            elif not viewer.stale:
+                viewer.queue(message)
+
+    def poll(self):
+        # Take in new viewers and keys, and send what is waiting
+        for key, _ in self.selector.select(0):
+            if key.fileobj is self.listener:
+                self.accept()
+            else:
+                self.receive(self.viewers[key.fileobj])
+        for viewer in list(self.viewers.values()):
+            if viewer.stale and not viewer.backlog:
+                viewer.stale = False
+                viewer.queue(encode(b"K", self.frame, self.shape, bytes(len(self.screen)),
+                                    self.screen))
+            try:
+                viewer.flush()
+            except OSError:
+                self.drop(viewer)
+
+    def accept(self):
+        try:
+            sock, _ = self.listener.accept()
+        except (BlockingIOError, InterruptedError):
+            return
+        sock.setblocking(False)
+        self.viewers[sock] = Viewer(sock)
+        self.selector.register(sock, selectors.EVENT_READ)
+
+    def receive(self, viewer):
+        try:
+            data = viewer.sock.recv(4096)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b""
+        if not data:
+            self.drop(viewer)
+            return
+        viewer.inbox += data
+        keys = viewer.keys
+        while len(viewer.inbox) >= KEYS.size:
+            kind, mask = KEYS.unpack_from(viewer.inbox)
+            viewer.inbox = viewer.inbox[KEYS.size:]
+            if kind == b"k":
+                keys = mask
+        if keys != viewer.keys:
+            viewer.keys = keys
+            self.update_keys()
+
+    def drop(self, viewer):
+        self.selector.unregister(viewer.sock)
+        del self.viewers[viewer.sock]
+        viewer.sock.close()
+        if viewer.keys:
+            self.update_keys()
+
+    def update_keys(self):
+        held = 0
+        for viewer in self.viewers.values():
+            held |= viewer.keys
+        self.chip.keys[:] = bytes(held >> key & 1 for key in range(16))
+
+    def close(self):
+        for viewer in list(self.viewers.values()):
+            self.drop(viewer)
+        self.selector.close()
+        self.listener.close()
+        if self.family == socket.AF_UNIX:
+            try:
+                os.unlink(self.address)
+            except OSError:
+                pass
+
+def serve(chip, runner, address, tpf, frames=None, flags=None):
+    # Run the frame loop in real time without a display, streaming the
+    # screen on address, until the ROM exits or frames have run. The
+    # machine's flags are saved to flags, a RomFlags, as they change.
+    server = Server(chip, address)
+    print(f"Streaming on {address}", file=sys.stderr)
+    start = time.perf_counter()
+    frame = 0
+    try:
+        while frames is None or frame < frames:
+            server.poll()
+            if runner.run(tpf) == "exit":
+                return chip.state(frame, exited=True)
+            chip.tick_timers()
+            if chip.drawFlag:
+                chip.drawFlag = False
+                server.publish()
+            if flags:
+                flags.update(chip.flags)
+            frame += 1
+            delay = start + frame / FPS - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                start -= delay # Fell behind, so don't rush to catch up
+        return chip.state(frame)
+    finally:
+        server.close()
+
+class Client:
+    # A viewer's end of the connection
+    def __init__(self, address):
+        family, address = parse_address(address)
+        self.sock = socket.socket(family, socket.SOCK_STREAM)
+        self.sock.connect(address)
+        self.shape = None
+        self.screen = b""
+
+    def keys(self, mask):
+        # Hold down the keys in mask, and let go of the rest
+        self.sock.sendall(KEYS.pack(b"k", mask))
+
+    def receive(self, size):
+        data = b""
+        while len(data) < size:
+            chunk = self.sock.recv(size - len(data))
+            if not chunk:
+                raise EOFError("The server closed the connection")
+            data += chunk
+        return data
+
+    def frames(self):
+        # Yields (frame, (width, height, planes), screen) as frames arrive
+        while True:
+            length, = LENGTH.unpack(self.receive(LENGTH.size))
+            frame, self.shape, self.screen = decode(self.receive(length), self.screen)
+            yield frame, self.shape, self.screen
+
+    def close(self):
+        self.sock.close()
+
+def render(shape, data):
+    # The screen as text, like main.py's headless output
+    width, height, planes = shape
+    size = width * height
+    pixels = [int.from_bytes(data[i * size // 8:(i + 1) * size // 8], "big") for i in range(planes)]
+    lines = []
+    for y in range(height):
+        line = ""
+        for x in range(width):
+            bit = size - 1 - (y * width + x)
+            line += " #*@"[sum((plane >> bit & 1) << i for i, plane in enumerate(pixels))]
+        lines.append(line)
+    return "\n".join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description="Watch a machine streamed by main.py --serve")
+    parser.add_argument("address",
+                        help="unix:PATH, a path, HOST:PORT or :PORT")
+    parser.add_argument("--keys", type=lambda mask: int(mask, 16), default=0,
+                        help="Hex mask of keys to hold down")
+    args = parser.parse_args()
+    client = Client(args.address)
+    try:
+        if args.keys:
+            client.keys(args.keys)
+        for frame, shape, data in client.frames():
+            sys.stdout.write(f"\x1b[H\x1b[2JFrame {frame}\n{render(shape, data)}\n")
+            sys.stdout.flush()
+    except (EOFError, KeyboardInterrupt):
+        pass
+    finally:
+        client.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,159 @@
+import os, time
+
+import pygame
+import pygame.locals as plocals
+
+import snapshot
+from audio import AudioStream
+from palette import PALETTE
+
+PIX_SIZE = 20
+FPS = 60 # Frames per Second
+TIMER_HZ = 60 # Delay and sound timer ticks per second
+KEYMAP = {
+    plocals.K_1: 0x1, plocals.K_2: 0x2, plocals.K_3: 0x3, plocals.K_4: 0xC,
+    plocals.K_q: 0x4, plocals.K_w: 0x5, plocals.K_e: 0x6, plocals.K_r: 0xD,
+    plocals.K_a: 0x7, plocals.K_s: 0x8, plocals.K_d: 0x9, plocals.K_f: 0xE,
+    plocals.K_z: 0xA, plocals.K_x: 0x0, plocals.K_c: 0xB, plocals.K_v: 0xF,
+
+    plocals.K_SPACE: 0x6,
+
+                         plocals.K_UP:   0x5,
+    plocals.K_LEFT: 0x7, plocals.K_DOWN: 0x8, plocals.K_RIGHT: 0x9,
+}
+
+class Renderer:
+    # Draws the framebuffer onto a native resolution 8-bit surface, scales
+    # that onto the window in one go, and only updates the rows that
+    # changed since the last frame
+    def __init__(self, win):
+        self.win = win
+        self.last = None # (hires, pixels) of the last frame drawn
+
+    def draw(self, chip):
+        hires = chip.type in ["SCHIP", "XO-CHIP"] and chip.hires
+        width, height = (128, 64) if hires else (64, 32)
+        size = width*height
+        pixels = bytes(chip.gfx[:size])
+        if chip.type == "XO-CHIP":
+            # Palette index: bit 0 from gfx, bit 1 from gfx2
+            pixels = (int.from_bytes(pixels, "big") |
+                      int.from_bytes(chip.gfx2[:size], "big") << 1).to_bytes(size, "big")
+
+        if self.last and self.last[0] == hires:
+            last = self.last[1]
+            dirty = [y for y in range(height)
+                     if pixels[y*width:(y+1)*width] != last[y*width:(y+1)*width]]
+        else:
+            dirty = list(range(height))
+        self.last = (hires, pixels)
+        if not dirty:
+            return
+
+        surface = pygame.image.frombuffer(pixels, (width, height), "P")
+        surface.set_palette(PALETTE)
+        pygame.transform.scale(surface.convert(self.win), self.win.get_size(), self.win)
+        # One rect per run of changed rows
+        scale = self.win.get_height() // height
+        rects = []
+        for y in dirty:
+            if rects and rects[-1][1] + rects[-1][3] == y*scale:
+                rects[-1][3] += scale
+            else:
+                rects.append([0, y*scale, self.win.get_width(), scale])
+        pygame.display.update(rects)
+
+def restore(c, runner, load):
+    # Load an earlier state with load(), but keep the keys held down now
+    keys = bytes(c.keys)
+    load()
+    c.keys[:] = keys
+    c.drawFlag = True
+    if runner is not c:
+        # Compiled blocks may not match the restored memory
+        runner.flush()
+
+def run(c, runner, filename, speed, recorder=None, flags=None):
+    # Interactive loop: draw, play the sound and read the keyboard.
+    # F5 saves the machine's state, F9 loads it again, and holding
+    # Backspace rewinds. Loading and rewinding are off while recording,
+    # as a replay could not follow them. The machine's flags are saved to
+    # flags, a RomFlags, as they change.
+    pygame.display.init()
+    win = pygame.display.set_mode((64*PIX_SIZE,32*PIX_SIZE))
+    pygame.display.set_caption("Chippy")
+
+    renderer = Renderer(win)
+    renderer.draw(c)
+    clock = pygame.time.Clock()
+    sound = AudioStream()
+    start = time.perf_counter()
+    ticks = 0 # Timer ticks so far
+    rewind = snapshot.Rewind()
+    rewinding = False
+    try:
+        while True:
+            frame_start = time.perf_counter()
+            skipped = c.skipped
+            if rewinding and len(rewind) > 1:
+                # Step back a frame instead of running one
+                restore(c, runner, lambda: rewind.rewind(c))
+                count = 0
+            else:
+                count = speed.next_frame()
+                if recorder:
+                    recorder.frame(c.keys, count)
+                if runner.run(count) == "exit":
+                    raise KeyboardInterrupt()
+                if not recorder:
+                    rewind.push(c)
+            emulated = time.perf_counter()
+            if c.drawFlag:
+                c.drawFlag = False
+                renderer.draw(c)
+            for event in pygame.event.get():
+                if event.type == pygame.KEYDOWN:
+                    if event.key in KEYMAP:
+                        c.keys[KEYMAP[event.key]] = 1
+                    elif event.key == plocals.K_F5:
+                        with open(filename + ".state", "wb") as f:
+                            f.write(snapshot.save(c))
+                    elif recorder:
+                        pass
+                    elif event.key == plocals.K_F9 and os.path.isfile(filename + ".state"):
+                        with open(filename + ".state", "rb") as f:
+                            saved = f.read()
+                        restore(c, runner, lambda: snapshot.restore(c, saved))
+                    elif event.key == plocals.K_BACKSPACE:
+                        rewinding = True
+                if event.type == pygame.KEYUP:
+                    if event.key in KEYMAP:
+                        c.keys[KEYMAP[event.key]] = 0
+                    elif event.key == plocals.K_BACKSPACE:
+                        rewinding = False
+                if event.type == pygame.QUIT:
+                    raise KeyboardInterrupt()
+            if speed.frame_done(count, emulated - frame_start,
+                                time.perf_counter() - frame_start, c.skipped - skipped):
+                pygame.display.set_caption(
+                    f"Chippy ({speed.report()}, {c.skipped} idle skipped)"
+                )
+            if speed.throttled:
+                clock.tick(FPS)
+                # The timers follow the wall clock, so they keep exact time
+                # whether emulation falls behind or runs ahead
+                due = int((time.perf_counter() - start) * TIMER_HZ)
+                elapsed = due - ticks
+                ticks = due
+            else:
+                # Turbo: one tick per emulated frame
+                elapsed = 1
+            sound.update(c, elapsed)
+            c.tick_timers(elapsed)
+            if recorder:
+                recorder.tick(elapsed)
+            if flags:
+                flags.update(c.flags)
+    finally:
+        pygame.quit()
+        print(speed.report())